@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from sqlite3 import connect
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.sjournal.sjournal import Note  # noqa: E402
+
+# Compare building Note objects for a large journal against the previous Note implementation
+# (per-instance __dict__, timestamp parsed and formatted in the constructor).
+# Usage: python benchmarks/notes.py [rows]
+
+
+class EagerNote:
+    def __init__(self, id, category, content, date_time=None):
+        self.id = id
+        self.category = category
+        self.content = content
+        if not date_time:
+            self.date_time = datetime.now()
+        else:
+            self.date_time = date_time
+        self.timestamp = datetime.strftime(self.date_time, "%m-%d-%y %H:%M:%S")
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row[0], row[2], row[3], date_time=datetime.fromtimestamp(row[1]))
+
+
+def build(note_class, rows):
+    # Timed and measured in separate passes, since tracing allocations slows everything down
+    start = time.perf_counter()
+    notes = [note_class.from_row(row) for row in rows]
+    elapsed = time.perf_counter() - start
+    del notes
+
+    tracemalloc.start()
+    notes = [note_class.from_row(row) for row in rows]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del notes
+    return elapsed, memory
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    with tempfile.TemporaryDirectory() as directory:
+        connection = connect(os.path.join(directory, "benchmark.db"))
+        connection.execute("CREATE TABLE notes(id integer PRIMARY KEY, timestamp integer, category text, content text)")
+        now = int(time.time())
+        connection.executemany("INSERT INTO notes VALUES (?, ?, ?, ?)",
+                               ((i, now - i, f"Category {i % 10}", f"benchmark note {i}") for i in range(count)))
+        connection.commit()
+        rows = connection.execute("SELECT * FROM notes").fetchall()
+        connection.close()
+
+    print(f"{count:,} notes")
+    results = {}
+    for name, note_class in [("eager Note", EagerNote), ("Note", Note)]:
+        elapsed, memory = build(note_class, rows)
+        results[name] = (elapsed, memory)
+        print(f"{name:<12} {elapsed:6.2f} s  {count / elapsed:12,.0f} notes/s  {memory / 2 ** 20:8.1f} MiB")
+
+    (old_time, old_memory), (new_time, new_memory) = results["eager Note"], results["Note"]
+    print(f"{'speedup':<12} {old_time / new_time:6.1f} x  memory {new_memory / old_memory:.0%} of eager")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Measure cold-interpreter wall time of short sjournal commands against a throwaway home directory.
+# Usage: python benchmarks/startup.py [runs]
+
+TARGET_MS = 100
+COMMANDS = [
+    ["add", "benchmark note"],
+    ["list"],
+]
+
+
+def time_command(argv, env, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(argv, env=env, stdout=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings), sorted(timings)[len(timings) // 2]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    run_py = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "run.py")
+
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home, USERPROFILE=home)
+        # First call creates the config file and journal so it is not counted
+        subprocess.run([sys.executable, run_py, "list"], env=env, stdout=subprocess.DEVNULL, check=True)
+
+        best, median = time_command([sys.executable, "-c", "pass"], env, runs)
+        print(f"{'bare interpreter':<23} best {best:6.1f} ms   median {median:6.1f} ms")
+
+        for command in COMMANDS:
+            best, median = time_command([sys.executable, run_py] + command, env, runs)
+            status = "OK" if median < TARGET_MS else "SLOW"
+            print(f"sj {' '.join(command):<20} best {best:6.1f} ms   median {median:6.1f} ms   [{status}, target {TARGET_MS} ms]")
+
+
+if __name__ == "__main__":
+    main()
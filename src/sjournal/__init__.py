@@ -1,4 +1,28 @@
+from importlib import import_module
+
 from .utilities.version import __version__
-from .sjournal import main, SJournal, Note
-from .utilities.arguments import parse_args
-from .utilities.utilities import get_newest_file, range_parser
\ No newline at end of file
+
+# Names are imported from their modules on first use, so an entry point such as "sjc" (sjournal.client) can
+# start without loading the whole package
+_EXPORTS = {
+    "main": ".sjournal",
+    "main_headless": ".sjournal",
+    "main_client": ".client",
+    "SJournal": ".sjournal",
+    "Note": ".sjournal",
+    "parse_args": ".utilities.arguments",
+    "get_newest_file": ".utilities.utilities",
+    "range_parser": ".utilities.utilities",
+    "fts_query": ".utilities.utilities",
+    "id_filter": ".utilities.utilities",
+}
+
+__all__ = ["__version__"] + list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
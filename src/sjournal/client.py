@@ -0,0 +1,16 @@
+import sys
+
+from .utilities.daemon import forward, socket_path
+
+# Entry point of "sjc". It only imports the daemon protocol (socket, json, struct), so a command served by a
+# running "sjournal daemon" does not pay for loading the rest of sjournal. The full command line is imported
+# only when no daemon takes the command.
+
+
+def main_client():
+    status = forward(socket_path(), sys.argv[1:])
+    if status is None:
+        from .sjournal import main
+        main()
+    else:
+        sys.exit(status)
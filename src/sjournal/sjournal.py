@@ -1,27 +1,55 @@
 # Standard Library
-import json
+import argparse
+import csv
+import io
 import re
 import os
-import shutil
+import sys
+import time
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
 from datetime import datetime
-from sqlite3 import Error, connect, ProgrammingError
+from itertools import islice
+from sqlite3 import Error, connect, OperationalError, ProgrammingError
 
 # External Libraries
-import PySimpleGUI as sg
-from rich.table import Table
-from rich.console import Console
-from rich.prompt import Prompt
-import pyperclip
+# PySimpleGUI, rich and pyperclip are imported inside the methods that use them so that
+# short commands such as "sj add" do not pay for the GUI and rendering stacks at startup.
 
 # Internal modules
-from .utilities.utilities import get_newest_file, range_parser
+from .utilities.utilities import get_newest_file, fts_query, apply_style, parse_timestamp, id_filter, \
+    compile_pattern, regexp, parse_time_filter, restyle
+from .utilities.schema import migrate, SCHEMA_VERSION
+from .utilities.config import default_config, load_config, save_config
+from .utilities.transfer import guess_format, read_records, write_categories, write_output, write_records
 from .utilities.arguments import parse_args
 
 # Version
 from .utilities.version import __version__
 
 
+# Next note ID, computed inside the INSERT that uses it. IDs start at 0.
+NEXT_ID = "(SELECT coalesce(max(id), -1) + 1 FROM {table})"
+
+# Notes refer to their category by ID; a category is added to the categories table before its first note
+ADD_CATEGORY = "INSERT OR IGNORE INTO categories (name) VALUES (?)"
+CATEGORY_ID = "(SELECT id FROM categories WHERE name = {name})"
+
+# Columns of the note tables: (header, style)
+PRINT_COLUMNS = [("ID", "cyan"), ("Timestamp", None), ("Category", "bold green"), ("Content", "white")]
+# Results longer than this are rendered in chunks of this many rows as they are read
+RENDER_CHUNK = 100
+
+JOURNAL_MODES = ["wal", "delete", "truncate", "persist", "memory", "off"]
+SYNCHRONOUS_MODES = ["off", "normal", "full", "extra"]
+
+
 class SJournal:
+    # Commands whose method name differs from the command name (e.g. Python keywords)
+    command_methods = {"import": "import_notes"}
+    # Commands "sjournal daemon" runs for clients. Anything that opens an editor, reads or writes files
+    # relative to the client, or changes the config runs in the client itself.
+    daemon_commands = ["add", "categories", "delete", "list", "search"]
+
     def __init__(self, args):
         self.root_dir = os.path.dirname(os.path.abspath(__file__))
         self.user_home_dir = os.path.expanduser('~')
@@ -29,19 +57,46 @@ class SJournal:
         self.db_file = ""
         self.journal_dir = ""
         self.journal_name = ""
+        self.config = {}
+        self.connection = None
+        # Depth of nested transaction() blocks; helpers only commit outside of them
+        self._transaction_depth = 0
         self.args = args
-        self.console = Console()
+        self.headless = getattr(args, "no_gui", False)
+        # Open connections by database file, kept across commands by "sjournal daemon"
+        self.shared_connections = None
+        # Raw output (--format, export to stdout) bypasses rich and goes here
+        self.output = sys.stdout
+        self._console = None
+        self._table = None
         self.load()
 
-        # self.create_connection()
-        self.table = Table(title=self.journal_name)
-        self.setup_table()
+    @property
+    def console(self):
+        if self._console is None:
+            from rich.console import Console
+            self._console = Console()
+        return self._console
+
+    @console.setter
+    def console(self, console):
+        self._console = console
+
+    @property
+    def table(self):
+        if self._table is None:
+            from rich.table import Table
+            self._table = Table(title=self.journal_name)
+            self.setup_table()
+        return self._table
+
+    @table.setter
+    def table(self, table):
+        self._table = table
 
     def setup_table(self):
-        self.table.add_column("ID", style="cyan")
-        self.table.add_column("Timestamp")
-        self.table.add_column("Category", style="bold green")
-        self.table.add_column("Content", style="white")
+        for header, style in PRINT_COLUMNS:
+            self.table.add_column(header, style=style)
 
     def handle_args(self):
         # If a command was specified, use it. Otherwise, assume List command
@@ -49,34 +104,167 @@ class SJournal:
 
         if self.args.command:
             if self.args.command != "load":
-                return getattr(self, self.args.command)
+                return getattr(self, self.command_methods.get(self.args.command, self.args.command))
         else:
             return self.list
 
     def create_connection(self):
+        # WAL lets readers run alongside a writer; writers wait up to busy_timeout ms for each other
+        # instead of failing with "database is locked"
+        journal_mode = self.config.get("journal_mode", "wal").lower()
+        synchronous = self.config.get("synchronous", "normal").lower()
+        busy_timeout = int(self.config.get("busy_timeout", 5000))
+        if journal_mode not in JOURNAL_MODES or synchronous not in SYNCHRONOUS_MODES:
+            self.console.print(f"Invalid journal_mode or synchronous setting in {self.config_file}")
+            exit(1)
+        if self.shared_connections is not None and self.db_file in self.shared_connections:
+            self.connection = self.shared_connections[self.db_file]
+            return
+
+        def open_journal():
+            conn = connect(self.db_file, timeout=busy_timeout / 1000)
+            conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+            conn.execute(f"PRAGMA synchronous = {synchronous}")
+            # Regular expression filters run inside SQLite, so only matching rows are read into Python
+            conn.create_function("REGEXP", 2, regexp, deterministic=True)
+            conn.create_function("restyle", 2, restyle, deterministic=True)
+            return conn
+
         try:
-            conn = connect(self.db_file)
+            try:
+                conn = open_journal()
+            except OperationalError:
+                # The journal directory is created here rather than checked on every command
+                if os.path.isdir(self.journal_dir):
+                    raise
+                os.makedirs(self.journal_dir)
+                conn = open_journal()
             self.connection = conn
-        except Error:
-            self.console.print(Error)
+            if self.shared_connections is not None:
+                self.shared_connections[self.db_file] = conn
+        except Error as error:
+            self.console.print(error)
             self.connection = None
 
     def close_connection(self):
-        self.connection.close()
+        if self.shared_connections is None and self.connection is not None:
+            self.connection.close()
+
+    def commit(self):
+        if not self._transaction_depth:
+            self.connection.commit()
+
+    @classmethod
+    def open(cls, journal_name=None):
+        # Open a journal for use as a library: "with SJournal.open("work") as journal: ...". Uses the current
+        # journal from the config if no name is given, and never changes the config.
+        journal = cls(argparse.Namespace(command=None, debug=False, no_gui=True))
+        if journal_name is not None:
+            journal.journal_name = journal_name
+            journal.db_file = os.path.join(journal.journal_dir, f"{journal_name}.db")
+        journal.create_connection()
+        migrate(journal.connection)
+        return journal
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close_connection()
+
+    @contextmanager
+    def transaction(self):
+        # Run a block of changes as one transaction, committed at the end or rolled back on an exception.
+        # Nested blocks become savepoints, and helpers called inside a block leave committing to it.
+        depth = self._transaction_depth
+        if depth == 0:
+            if self.connection.in_transaction:
+                self.connection.commit()
+            self.new_cursor().execute("BEGIN IMMEDIATE")
+        else:
+            self.connection.execute(f"SAVEPOINT sjournal_{depth}")
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth = depth
+            if depth == 0:
+                self.connection.rollback()
+            else:
+                self.connection.execute(f"ROLLBACK TO sjournal_{depth}")
+                self.connection.execute(f"RELEASE sjournal_{depth}")
+            raise
+        self._transaction_depth = depth
+        if depth == 0:
+            self.connection.commit()
+        else:
+            self.connection.execute(f"RELEASE sjournal_{depth}")
+
+    def add_many(self, notes, category="General", batch_size=1000):
+        # Add notes given as content strings or records (dicts with "content" and optionally "category",
+        # "style" and "timestamp") in one transaction. Returns the number of notes added.
+        records = ({"content": note} if isinstance(note, str) else note for note in notes)
+        with self.transaction():
+            return self.insert_many(self.record_rows(records, category), batch_size)
+
+    def delete_many(self, ids):
+        # Delete notes by ID or range ("3", "7-9", "12-") in one statement. Returns the number deleted.
+        ids = [str(item) for item in ids]
+        if not ids:
+            return 0
+        condition, params = id_filter(ids)
+        with self.transaction():
+            return self.new_cursor().execute(f"DELETE FROM notes WHERE {condition}", params).rowcount
+
+    def update_many(self, changes):
+        # Apply changes given as dicts with an "id" and any of "category", "content" and "timestamp" in one
+        # transaction. Changes that set the same columns share one executemany, so a batch that leaves the content
+        # alone never fires the full-text index trigger. Returns the number of notes updated.
+        assignments = {"category": f"category_id = {CATEGORY_ID.format(name='?')}",
+                       "content": "content = ?", "timestamp": "timestamp = ?"}
+        groups = {}
+        for change in changes:
+            keys = tuple(key for key in assignments if change.get(key) not in (None, ""))
+            if keys:
+                groups.setdefault(keys, []).append(change)
+        with self.transaction():
+            cursor = self.new_cursor()
+            cursor.executemany(ADD_CATEGORY, {(change["category"],) for keys, group in groups.items()
+                                              if "category" in keys for change in group})
+            updated = 0
+            for keys, group in groups.items():
+                rows = ([parse_timestamp(change[key]) if key == "timestamp" else change[key] for key in keys]
+                        + [change["id"]] for change in group)
+                updated += cursor.executemany(
+                    f"UPDATE notes SET {', '.join(assignments[key] for key in keys)} WHERE id = ?", rows).rowcount
+            return updated
+
+    def get(self, note_id):
+        row = self.new_cursor().execute("SELECT * FROM note_rows WHERE id = ?", (note_id,)).fetchone()
+        return Note.from_row(row) if row else None
+
+    def count(self, category=None, ids=None, since=None, until=None):
+        where, params = self.build_filters(category=category, ids=ids, since=since, until=until)
+        table = "note_rows" if where else "notes"
+        return self.new_cursor().execute(f"SELECT count(*) FROM {table}" + where, params).fetchone()[0]
+
+    def find(self, criteria, regex=False, category=None, limit=None):
+        # Notes matching a search, ranked as "sjournal search" ranks them
+        return [Note.from_row(row) for row in self.match_rows(criteria, regex=regex, category=category,
+                                                              quantity=limit)]
 
     def new_cursor(self):
         try:
             return self.connection.cursor()
-        except ProgrammingError:
+        except (AttributeError, ProgrammingError):
+            # Not connected yet, or the connection was closed at the end of run()
             self.create_connection()
             return self.connection.cursor()
 
     def run(self):
 
         self.create_connection()
-
-        if not self.table_exists("notes"):
-            self.create_table("notes", "id integer PRIMARY KEY, timestamp text, category text, content text")
+        migrate(self.connection)
 
         action = self.handle_args()
 
@@ -90,6 +278,7 @@ class SJournal:
             self.console.print(f"debug output at {debug_file}")
 
             with open(debug_file, "wt") as debug_log:
+                from rich.console import Console
                 self.console = Console(file=debug_log, width=100)
                 if action:
                     action()
@@ -99,27 +288,23 @@ class SJournal:
 
         self.close_connection()
 
-    def table_exists(self, table_name):
-        cursor = self.new_cursor()
-        cursor.execute(f"SELECT count(name) FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-        # if the count is 1, then table exists
-        if cursor.fetchone()[0] == 1:
-            return True
-        else:
-            return False
-
-    def create_table(self, name, table_string):
-        query = f"CREATE TABLE {name}({table_string})"
-        cursor = self.new_cursor()
-        cursor.execute(query)
-        self.connection.commit()
-
     def insert_into_database_table(self, table_name, note):
+        # A note without an ID gets the next one inside the INSERT itself, so concurrent writers cannot collide
         cursor = self.new_cursor()
-        cursor.execute(f"INSERT INTO {table_name} (id, timestamp, category, content) VALUES (:id, :timestamp, :category, :content)", note.dict)
-        self.connection.commit()
+        cursor.execute(ADD_CATEGORY, (note.category,))
+        category_id = CATEGORY_ID.format(name=":category")
+        if note.id is None:
+            cursor.execute(f"INSERT INTO {table_name} (id, timestamp, category_id, content) VALUES "
+                           f"({NEXT_ID.format(table=table_name)}, :timestamp, {category_id}, :content)", note.record)
+            note.id = cursor.lastrowid
+        else:
+            cursor.execute(f"INSERT INTO {table_name} (id, timestamp, category_id, content) VALUES "
+                           f"(:id, :timestamp, {category_id}, :content)", note.record)
+        self.commit()
 
     def add_gui(self):
+        import PySimpleGUI as sg
+
         sg.theme('DarkGrey')
 
         layout = [
@@ -157,9 +342,10 @@ class SJournal:
             return None
 
     def add(self):
-        cursor = self.new_cursor()
-
         if len(self.args.content) == 0:
+            if self.headless:
+                self.console.print("No note content given (the note editor is disabled with --no-gui)")
+                exit(1)
             values = self.add_gui()
             if values:
                 self.args.style = values['style']
@@ -167,24 +353,108 @@ class SJournal:
                 self.args.content = [values['content']]
             else:
                 exit()
-        note_content = ' '.join(self.args.content)
-        if self.args.style:
-            note_content = f"[{self.args.style}]{note_content}[/]"
-        else:
-            note_content = note_content
+        note_content = apply_style(' '.join(self.args.content), self.args.style)
 
-        note_data = {"category": self.args.category, "content": note_content}
+        note = Note(None, self.args.category, note_content)
+        self.insert_into_database_table("notes", note)
 
-        cursor.execute(f"SELECT id FROM notes ORDER BY id DESC LIMIT 1")
+    def insert_many(self, rows, batch_size=1000):
+        # Insert (timestamp, category, content) rows with executemany in batches, each row taking the next ID
+        # inside its INSERT. Must run inside a transaction. Returns the number of rows inserted.
+        cursor = self.new_cursor()
 
-        try:
-            most_recent_id = cursor.fetchone()[0]
-        except TypeError:
-            most_recent_id = -1
+        # Index and count the new notes with set-based statements instead of firing a trigger per row
+        suspended = []
+        for name in ["notes_fts_insert", "categories_count_insert"]:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name=?", (name,))
+            trigger = cursor.fetchone()
+            if trigger:
+                cursor.execute(f"DROP TRIGGER {name}")
+                suspended.append((name, trigger[0]))
+
+        query = (f"INSERT INTO notes (id, timestamp, category_id, content) "
+                 f"VALUES ({NEXT_ID.format(table='notes')}, ?, {CATEGORY_ID.format(name='?')}, ?)")
+
+        def insert(batch):
+            cursor.executemany(ADD_CATEGORY, {(row[1],) for row in batch})
+            cursor.executemany(query, batch)
+
+        first_id = None
+        inserted = 0
+        batch = []
+        for row in rows:
+            if first_id is None:
+                # The transaction holds the write lock from here on, so the following IDs are consecutive
+                cursor.execute(ADD_CATEGORY, (row[1],))
+                cursor.execute(query, row)
+                first_id = cursor.lastrowid
+                inserted += 1
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                insert(batch)
+                inserted += len(batch)
+                batch = []
+        if batch:
+            insert(batch)
+            inserted += len(batch)
+
+        for name, sql in suspended:
+            if first_id is not None:
+                if name == "notes_fts_insert":
+                    cursor.execute("INSERT INTO notes_fts(rowid, content) SELECT id, content FROM notes WHERE id >= ?",
+                                   (first_id,))
+                else:
+                    cursor.execute("UPDATE categories SET note_count = note_count + "
+                                   "(SELECT count(*) FROM notes WHERE category_id = categories.id AND id >= ?)",
+                                   (first_id,))
+            cursor.execute(sql)
+
+        return inserted
+
+    @staticmethod
+    def record_rows(records, category="General"):
+        # (timestamp, category, content) rows for insert_many from records with a content and optional
+        # category, style and timestamp
+        for record in records:
+            content = record.get("content")
+            if content is None or not str(content).strip():
+                raise ValueError("a note has no content")
+            yield (parse_timestamp(record.get("timestamp")),
+                   record.get("category") or category,
+                   apply_style(str(content), record.get("style")))
+
+    def import_notes(self):
+        filename = getattr(self.args, "filename", None)
+        file_format = self.args.format or guess_format(filename)
+        batch_size = max(1, self.args.batch_size)
+
+        if filename is None or filename == "-":
+            stream = sys.stdin
+        elif os.path.isfile(filename):
+            # newline="" lets the csv module handle line endings inside quoted fields
+            stream = open(filename, "r", newline="", encoding="utf-8")
+        else:
+            self.console.print(f"Failed to import: file {filename} not found.")
+            return
 
-        note = Note(most_recent_id+1, note_data["category"], note_data["content"])
-        self.insert_into_database_table("notes", note)
-        self.connection.commit()
+        rows = self.record_rows(read_records(stream, file_format), self.args.category)
+
+        start = time.perf_counter()
+        try:
+            # One transaction for the whole import: either every note is added or none is
+            with self.transaction():
+                imported = self.insert_many(rows, batch_size)
+        except (ValueError, csv.Error) as error:
+            self.console.print(f"IMPORT FAILED, NO NOTES WERE ADDED: {error}")
+            return
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.perf_counter() - start
+        rate = imported / elapsed if elapsed > 0 else imported
+        self.console.print(f"IMPORTED {imported} NOTES IN {elapsed:.2f}s ({rate:,.0f} notes/s)")
 
     def insert_into_print_table(self, note):
         self.table.add_row(str(note.id), str(note.timestamp), str(note.category), note.content)
@@ -192,7 +462,73 @@ class SJournal:
     def show_print_table(self):
         self.console.print(self.table)
 
+    def print_notes(self, rows):
+        # Render note rows as they come off the cursor. Short results are printed as one table; longer ones in
+        # tables of RENDER_CHUNK rows with fixed column widths, so the first rows appear without waiting for
+        # the rest and memory does not grow with the number of results.
+        if getattr(self.args, "format", None):
+            write_output(self.output, rows, self.args.format)
+            self.output.flush()
+            return
+
+        rows = iter(rows)
+        chunk = list(islice(rows, RENDER_CHUNK + 1))
+        if len(chunk) <= RENDER_CHUNK:
+            for row in chunk:
+                self.insert_into_print_table(Note.from_row(row))
+            self.show_print_table()
+            return
+
+        from rich.table import Table
+
+        last_id = self.connection.execute("SELECT max(id) FROM notes").fetchone()[0] or 0
+        widths = [max(2, len(str(last_id)), max(len(str(row[0])) for row in chunk)), 17, min(24, max(8, max(len(row[2]) for row in chunk))), None]
+        header = True
+        while chunk:
+            table = Table(title=self.journal_name if header else None, show_header=header, show_edge=False,
+                          expand=True)
+            for (name, style), width in zip(PRINT_COLUMNS, widths):
+                # Content takes whatever width the fixed columns leave
+                table.add_column(name, style=style, width=width, ratio=None if width else 1, overflow="fold")
+            for row in chunk:
+                note = Note.from_row(row)
+                table.add_row(str(note.id), str(note.timestamp), str(note.category), note.content)
+            self.console.print(table)
+            header = False
+            chunk = list(islice(rows, RENDER_CHUNK))
+
+    @contextmanager
+    def pager(self):
+        # Stream output through $PAGER (less by default) when --pager is given and stdout is a terminal
+        if not getattr(self.args, "pager", False) or getattr(self.args, "format", None) or \
+                not self.console.is_terminal:
+            yield
+            return
+
+        import subprocess
+        from rich.console import Console
+
+        console = self.console
+        process = subprocess.Popen(os.environ.get("PAGER") or "less -R", shell=True, stdin=subprocess.PIPE,
+                                   encoding="utf-8")
+        self.console = Console(file=process.stdin, force_terminal=True, width=console.width,
+                               color_system=console.color_system)
+        try:
+            yield
+        except BrokenPipeError:
+            # The pager was closed before all rows were shown
+            pass
+        finally:
+            self.console = console
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            process.wait()
+
     def edit(self):
+        from rich.prompt import Prompt
+        import pyperclip
 
         cursor = self.new_cursor()
 
@@ -202,8 +538,12 @@ class SJournal:
             cursor.execute(f"SELECT id FROM notes ORDER BY id DESC LIMIT 1")
             id_to_edit = cursor.fetchone()[0]
 
-        cursor.execute(f"SELECT category, content, timestamp FROM notes WHERE id={id_to_edit} ORDER BY id DESC LIMIT 1")
-        old_category, old_content, old_timestamp = cursor.fetchone()
+        cursor.execute("SELECT content FROM notes WHERE id = ?", (id_to_edit,))
+        row = cursor.fetchone()
+        if row is None:
+            self.console.print(f"Note #{id_to_edit} not found")
+            return
+        old_content = row[0]
 
         try:
             pyperclip.copy(old_content)
@@ -214,235 +554,816 @@ class SJournal:
 
         new_content = Prompt.ask("Enter new note text", default=old_content)
 
-        new_note = Note(id_to_edit, old_category, new_content)
-        new_note.timestamp = old_timestamp
-        cursor.execute(f'DELETE FROM notes WHERE id={id_to_edit}')
-        self.insert_into_database_table("notes", new_note)
-        self.connection.commit()
+        # Rewrite the content in place: the note keeps its ID, time and category, and its index entries
+        cursor.execute("UPDATE notes SET content = ? WHERE id = ?", (new_content, id_to_edit))
+        self.commit()
+
+    def update(self):
+        category, style = self.args.category, self.args.style
+        if not category and style is None:
+            self.console.print("Nothing to change: give a new --category and/or --style")
+            return
+        since, until = getattr(self.args, "since", None), getattr(self.args, "until", None)
+        if not self.args.ids and not since and not until:
+            self.console.print("No notes selected: give --ids, or --since/--until, to update")
+            return
+        try:
+            where, params = self.build_filters(ids=self.args.ids, since=since, until=until)
+        except ValueError as error:
+            self.console.print(f"Invalid filter: {error}")
+            return
 
-    def list(self):
+        assignments = []
+        values = []
         cursor = self.new_cursor()
+        # One set-based statement in one transaction; the category counts follow through their trigger
+        with self.transaction():
+            if category:
+                cursor.execute(ADD_CATEGORY, (category,))
+                assignments.append(f"category_id = {CATEGORY_ID.format(name='?')}")
+                values.append(category)
+            if style is not None:
+                assignments.append("content = restyle(content, ?)")
+                values.append(style)
+            cursor.execute(f"UPDATE notes SET {', '.join(assignments)}{where}", values + params)
+            updated = cursor.rowcount
+
+        self.console.print(f"UPDATED {updated} NOTE{'' if updated == 1 else 'S'}")
+
+    def note_filters(self):
+        # WHERE conditions and parameters for the category, ID and date filters shared by list and export
+        options = ["category", "ids", "since", "until", "before", "after"]
+        return self.build_filters(**{option: getattr(self.args, option, None) for option in options})
+
+    @staticmethod
+    def build_filters(category=None, ids=None, since=None, until=None, before=None, after=None):
+        # " WHERE ..." clause (or "") and its parameters for the given filters
+        conditions, params = SJournal.filter_conditions(category, ids, since, until, before, after)
+        if conditions:
+            return " WHERE " + " AND ".join(conditions), params
+        return "", params
+
+    @staticmethod
+    def filter_conditions(category=None, ids=None, since=None, until=None, before=None, after=None):
+        # ids are IDs and ranges as accepted on the command line; since and until are dates or times as
+        # parse_time_filter takes them, absolute or relative to now ("7d", "3h")
+        conditions = []
+        params = []
+        if category is not None:
+            conditions.append("category = ?")
+            params.append(category)
+        if ids:
+            condition, id_params = id_filter([str(item) for item in ids])
+            conditions.append(condition)
+            params += id_params
+        if since:
+            conditions.append("timestamp >= ?")
+            params.append(parse_time_filter(since))
+        if until:
+            conditions.append("timestamp < ?")
+            params.append(parse_time_filter(until))
+        if before is not None:
+            conditions.append("id < ?")
+            params.append(before)
+        if after is not None:
+            conditions.append("id > ?")
+            params.append(after)
+        return conditions, params
+
+    def note_order(self, direction="DESC"):
+        # Date filtered queries are ordered by time so the timestamp index serves both filter and order,
+        # unless they page by ID with --before/--after
+        keyset = getattr(self.args, "before", None) is not None or getattr(self.args, "after", None) is not None
+        if (getattr(self.args, "since", None) or getattr(self.args, "until", None)) and not keyset:
+            return f" ORDER BY timestamp {direction}, id {direction}"
+        return f" ORDER BY id {direction}"
 
-        query = "SELECT * FROM notes"
-        if hasattr(self.args, 'category') and self.args.category is not None:
-            query += f" WHERE category='{self.args.category}'"
-        query += " ORDER BY id DESC"
+    def list(self):
+        cursor = self.new_cursor()
 
+        try:
+            where, params = self.note_filters()
+        except ValueError as error:
+            self.console.print(f"Invalid filter: {error}")
+            return
+        limit = None
         if hasattr(self.args, "quantity") and not self.args.all:
             try:
-                query += f" LIMIT {self.args.quantity[0]}"
+                limit = self.args.quantity[0]
             except TypeError:
-                query += f" LIMIT {self.args.quantity}"
+                limit = self.args.quantity
         elif not hasattr(self.args, "all"):
-            query += f" LIMIT 5"
-
-        cursor.execute(query)
-        items_to_show = cursor.fetchall()
-        if hasattr(self.args, "reverse") and self.args.reverse:
-            items_to_show = items_to_show[::-1]
-        for item in items_to_show:
-            note = Note(item[0], item[2], item[3], date_time=datetime.strptime(item[1], "%m-%d-%y %H:%M:%S"))
-            self.insert_into_print_table(note)
+            limit = 5
+        if getattr(self.args, "page_size", None):
+            limit = self.args.page_size
+        page = getattr(self.args, "page", None)
+
+        # Notes are sought downwards from the newest note (or --before), or upwards from --after, and shown
+        # newest first unless --reverse is given
+        seek = "ASC" if getattr(self.args, "after", None) is not None else "DESC"
+        show = "ASC" if getattr(self.args, "reverse", False) else "DESC"
+        query = "SELECT * FROM note_rows" + where + self.note_order(seek)
+        if limit is not None:
+            if page and page > 1:
+                # Skip the earlier pages on the ID index alone, then read only the rows of this page
+                query = (f"SELECT * FROM note_rows WHERE id IN (SELECT id FROM note_rows{where}{self.note_order(seek)} "
+                         f"LIMIT {int(limit)} OFFSET {int(limit) * (page - 1)})" + self.note_order(seek))
+            else:
+                query += f" LIMIT {int(limit)}"
+            if seek != show:
+                query = f"SELECT * FROM ({query})" + self.note_order(show)
+        elif seek != show:
+            query = "SELECT * FROM note_rows" + where + self.note_order(show)
+
+        cursor.execute(query, params)
+        shown = []
+        with self.pager():
+            self.print_notes(self.track_ids(cursor, shown))
+            self.print_continuation(shown, limit, seek)
+
+    def track_ids(self, rows, ids):
+        # Pass rows through, remembering their IDs for the continuation hint
+        for row in rows:
+            ids.append(row[0])
+            yield row
+
+    def print_continuation(self, ids, limit, seek):
+        # After a full page, show how to get the next one. Only when paging options were used, and never
+        # in machine-readable output.
+        paging = ["before", "after", "page", "page_size"]
+        if not any(getattr(self.args, option, None) is not None for option in paging) or \
+                getattr(self.args, "format", None) or not limit or len(ids) < limit:
+            return
+        if getattr(self.args, "page", None):
+            hint = f"--page {self.args.page + 1}"
+        elif seek == "ASC":
+            hint = f"--after {max(ids)}"
+        else:
+            hint = f"--before {min(ids)}"
+        self.console.print(f"MORE NOTES: repeat with {hint}", style="dim")
 
-        self.show_print_table()
+    def export(self):
+        filename = getattr(self.args, "filename", None)
+        file_format = self.args.format or guess_format(filename, default="jsonl")
+        batch_size = max(1, self.args.batch_size)
 
-    def categories(self):
-        if hasattr(self.args, 'search') and self.args.search:
-            regex = f"{self.args.search}"
+        try:
+            where, params = self.note_filters()
+        except ValueError as error:
+            self.console.print(f"Invalid filter: {error}")
+            return
+        cursor = self.new_cursor()
+        cursor.execute("SELECT * FROM note_rows" + where + self.note_order("ASC"), params)
+
+        exported = 0
+
+        def rows():
+            # Walk the cursor in chunks so memory use does not grow with the journal
+            nonlocal exported
+            while True:
+                chunk = cursor.fetchmany(batch_size)
+                if not chunk:
+                    break
+                exported += len(chunk)
+                yield from chunk
+
+        if filename is None or filename == "-":
+            write_records(self.output, rows(), file_format, title=self.journal_name)
+            self.output.flush()
         else:
-            regex = ".*"
+            with open(filename, "w", newline="", encoding="utf-8") as export_file:
+                write_records(export_file, rows(), file_format, title=self.journal_name)
+            self.console.print(f"EXPORTED {exported} NOTES TO {filename}")
 
+    def categories(self):
+        # Counts come from the categories table, which triggers keep up to date, instead of the notes
         cursor = self.new_cursor()
-        query = f"Select distinct category from notes ORDER BY category ASC"
+        query = "SELECT name, note_count FROM categories WHERE note_count > 0"
+        params = []
+        if getattr(self.args, "search", None):
+            try:
+                compile_pattern(self.args.search)
+            except re.error as error:
+                self.console.print(f"Invalid pattern: {error}")
+                return
+            query += " AND name REGEXP ?"
+            params.append(self.args.search)
+        query += " ORDER BY name ASC"
 
         if hasattr(self.args, "quantity") and not self.args.all:
             query += f" LIMIT {self.args.quantity}"
 
-        cursor.execute(query)
-        for item in cursor.fetchall():
-            match = re.search(regex.lower(), item[0].lower())
-            if match:
-                self.console.print(item[0])
+        cursor.execute(query, params)
+        matches = cursor
+        if getattr(self.args, "format", None):
+            write_categories(self.output, (name for name, _ in matches), self.args.format)
+            self.output.flush()
+            return
+        for category, note_count in matches:
+            self.console.print(f"{category} [dim]({note_count})[/]")
 
     def delete(self):
-        ids_to_delete = range_parser(self.args.delete_criteria)
-        cursor = self.new_cursor()
-        for id in ids_to_delete:
-            if isinstance(id, int):
-
-                cursor.execute(f'DELETE FROM notes WHERE id={id}')
-                self.console.print(f"DELETED NOTE #{id}")
-            else:
-                regex_below = r"\W(\d*)"
-                regex_above = r"(\d*)\W"
-                match_below = re.search(regex_below, id)
-                match_above = re.search(regex_above, id)
-
-                if match_below and match_below.group(1).isnumeric():
-
-                    for i in range(0, int(match_below.group(1))+1):
-                        cursor.execute(f'DELETE FROM notes WHERE id={i}')
-                        self.console.print(f"DELETED NOTE #{i}")
-
-                elif match_above and match_above.group(1).isnumeric():
-                    cursor.execute('SELECT max(id) FROM notes')
-                    max_id = cursor.fetchone()[0]
-
-                    for i in range(int(match_above.group(1)), max_id+1):
-                        cursor.execute(f'DELETE FROM notes WHERE id={i}')
-                        self.console.print(f"DELETED NOTE #{i}")
+        since, until = getattr(self.args, "since", None), getattr(self.args, "until", None)
+        if not self.args.delete_criteria and not since and not until:
+            self.console.print("No notes selected: give note IDs or ranges, or --since/--until, to delete")
+            return
+        try:
+            where, params = self.build_filters(ids=self.args.delete_criteria, since=since, until=until)
+        except ValueError as error:
+            self.console.print(f"Invalid filter: {error}")
+            return
 
-        self.connection.commit()
+        cursor = self.new_cursor()
+        # One set-based statement in one transaction, however many IDs the ranges cover
+        with self.transaction():
+            if getattr(self.args, "verbose", False):
+                cursor.execute(f"SELECT id FROM notes{where} ORDER BY id", params)
+                deleted_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(f"DELETE FROM notes{where}", params)
+            deleted = cursor.rowcount
+
+        if getattr(self.args, "verbose", False):
+            for note_id in deleted_ids:
+                self.console.print(f"DELETED NOTE #{note_id}")
+        self.console.print(f"DELETED {deleted} NOTE{'' if deleted == 1 else 'S'}")
 
     def erase(self):
         cursor = self.new_cursor()
         cursor.execute('DELETE FROM notes')
-        self.connection.commit()
+        self.commit()
 
     def search(self):
         if hasattr(self.args, 'search_criteria'):
-            regex = f"{self.args.search_criteria[0]}"
+            criteria = " ".join(self.args.search_criteria)
         else:
-            regex = ".*"
+            criteria = ""
+
+        quantity = getattr(self.args, "page_size", None) or getattr(self.args, "quantity", None)
+        page = getattr(self.args, "page", None)
+        if page and not quantity:
+            quantity = 20
+        after = getattr(self.args, "after", None)
+        if getattr(self.args, "all_journals", False):
+            return self.search_all_journals(criteria, quantity, page)
+        try:
+            matches = self.match_rows(criteria, regex=getattr(self.args, "regex", False),
+                                      category=getattr(self.args, "category", None), quantity=quantity,
+                                      offset=quantity * (page - 1) if page else 0,
+                                      before=getattr(self.args, "before", None), after=after,
+                                      since=getattr(self.args, "since", None), until=getattr(self.args, "until", None))
+        except re.error as error:
+            self.console.print(f"Invalid pattern: {error}")
+            return
+        except ValueError as error:
+            self.console.print(f"Invalid filter: {error}")
+            return
+
+        shown = []
+        with self.pager():
+            self.print_notes(self.track_ids(matches, shown))
+            self.print_continuation(shown, quantity, "ASC" if after is not None else "DESC")
+
+    def search_all_journals(self, criteria, quantity, page):
+        # Search every journal in journal_dir at once, one worker thread and connection per journal, and merge
+        # their matches newest first. IDs are only unique within a journal, so rows carry the journal name.
+        import heapq
+        from concurrent.futures import ThreadPoolExecutor
+        from pathlib import Path
+
+        if getattr(self.args, "before", None) is not None or getattr(self.args, "after", None) is not None:
+            self.console.print("--before and --after page through one journal; use --page with --all-journals")
+            return
+        names = sorted(filename[:-len(".db")] for filename in os.listdir(self.journal_dir)
+                       if filename.endswith(".db") and os.path.isfile(os.path.join(self.journal_dir, filename)))
+        offset = quantity * (page - 1) if page else 0
+        options = {
+            "regex": getattr(self.args, "regex", False),
+            "category": getattr(self.args, "category", None),
+            "quantity": quantity + offset if quantity else None,
+            "since": getattr(self.args, "since", None),
+            "until": getattr(self.args, "until", None),
+            "newest": True,
+        }
 
-        cursor = self.new_cursor()
-        query = "SELECT * FROM notes"
-        if hasattr(self.args, 'category') and self.args.category is not None:
-            query += f" WHERE category='{self.args.category}'"
-        query += " ORDER BY id DESC"
+        def search_journal(name):
+            # Searching must not change the files: each one is opened read-only and never migrated, and files
+            # that are not journals at the current schema version are skipped
+            start = time.perf_counter()
+            journal = SJournal(argparse.Namespace(command=None, debug=False, no_gui=True))
+            path = os.path.join(self.journal_dir, f"{name}.db")
+            rows, skipped = [], None
+            try:
+                journal.connection = connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True,
+                                             timeout=int(self.config.get("busy_timeout", 5000)) / 1000)
+                journal.connection.create_function("REGEXP", 2, regexp, deterministic=True)
+                version = journal.connection.execute("PRAGMA user_version").fetchone()[0]
+                if version != SCHEMA_VERSION:
+                    skipped = f"schema version {version}, expected {SCHEMA_VERSION}"
+                else:
+                    rows = [row + (name,) for row in journal.match_rows(criteria, **options)]
+            except Error as error:
+                skipped = str(error)
+            finally:
+                journal.close_connection()
+            return name, rows, time.perf_counter() - start, skipped
 
-        if hasattr(self.args, "quantity") and not self.args.all:
-            query += f" LIMIT {self.args.quantity}"
+        try:
+            with ThreadPoolExecutor(max_workers=min(8, len(names) or 1)) as pool:
+                results = list(pool.map(search_journal, names))
+        except re.error as error:
+            self.console.print(f"Invalid pattern: {error}")
+            return
+        except ValueError as error:
+            self.console.print(f"Invalid filter: {error}")
+            return
 
-        cursor.execute(query)
-        for item in cursor.fetchall():
-            id = item[0]
-            category = item[2]
-            content = item[3]
-            match = re.search(regex.lower(), content.lower())
-            if match:
-                note = Note(id, category, content, date_time=datetime.strptime(item[1], "%m-%d-%y %H:%M:%S"))
-                self.insert_into_print_table(note)
+        if self.args.debug:
+            for name, rows, elapsed, skipped in results:
+                if skipped:
+                    self.console.print(f"SKIPPED {name}: {skipped}")
+                else:
+                    self.console.print(f"SEARCHED {name}: {len(rows)} MATCHES IN {elapsed * 1000:.1f} MS")
+
+        # Each journal's matches are already newest first, so merging them keeps that order
+        matches = heapq.merge(*(rows for _, rows, _, _ in results), key=lambda row: (row[1], row[0]), reverse=True)
+        matches = islice(matches, offset, offset + quantity if quantity else None)
+        if not getattr(self.args, "format", None):
+            # The table shows the journal with the ID, e.g. "work:12"
+            matches = ((f"{row[4]}:{row[0]}",) + row[1:4] for row in matches)
+
+        shown = []
+        with self.pager():
+            self.print_notes(self.track_ids(matches, shown))
+            self.print_continuation(shown, quantity, "DESC")
+
+        # Journals not opened since an upgrade would otherwise drop out of the results without a word
+        skipped = [name for name, _, _, reason in results if reason]
+        if skipped:
+            notice = (f"Skipped {len(skipped)} journal{'' if len(skipped) == 1 else 's'} ({', '.join(skipped)}); "
+                      f"run `sj load <name>` to upgrade")
+            if getattr(self.args, "format", None):
+                print(notice, file=sys.stderr)
+            else:
+                self.console.print(notice)
+
+    def match_rows(self, criteria, regex=False, category=None, quantity=None, offset=0, before=None, after=None,
+                   since=None, until=None, newest=False):
+        # Rows of the notes matching the search criteria: ranked full-text matches, or regular expression
+        # matches newest first. Paging with before/after walks the matches by ID instead of by rank, and
+        # newest orders every search by time (to merge the matches of several journals).
+        match_query = None
+        if criteria and not regex:
+            match_query = fts_query(criteria)
+        seek = "ASC" if after is not None else "DESC"
+        conditions, params = self.filter_conditions(category=category, since=since, until=until, before=before,
+                                                    after=after)
+        cursor = self.new_cursor()
 
-        self.show_print_table()
+        if match_query:
+            # Ranked full-text search, filtered and limited inside SQLite
+            conditions.append("notes_fts MATCH ?")
+            params.append(match_query)
+            query = ("SELECT note_rows.* FROM notes_fts JOIN note_rows ON note_rows.id = notes_fts.rowid WHERE " +
+                     " AND ".join(conditions))
+            if newest:
+                query += " ORDER BY note_rows.timestamp DESC, note_rows.id DESC"
+            elif before is None and after is None:
+                query += " ORDER BY notes_fts.rank, note_rows.id DESC"
+            else:
+                query += f" ORDER BY note_rows.id {seek}"
+        else:
+            # Regular expression search, filtered and limited inside SQLite through the REGEXP function
+            if criteria:
+                compile_pattern(criteria)  # report an invalid pattern before running the query
+                conditions.append("content REGEXP ?")
+                params.append(criteria)
+            query = "SELECT * FROM note_rows"
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += " ORDER BY timestamp DESC, id DESC" if newest else f" ORDER BY id {seek}"
+
+        if quantity:
+            query += " LIMIT ? OFFSET ?"
+            params += [quantity, offset]
+        if seek == "ASC":
+            query = f"SELECT * FROM ({query}) ORDER BY id DESC"
+        cursor.execute(query, params)
+        matches = cursor
+
+        return matches
 
     def backup(self):
+        from .utilities.backups import BackupCatalog, COMPRESSION_EXTENSIONS, INCREMENTAL_EXTENSION, \
+            strip_backup_extension
         backup_dir = os.path.join(self.journal_dir, "backups", self.journal_name)
 
         if not os.path.exists(backup_dir):
             os.makedirs(backup_dir)
 
-        if self.args.filename is None:
-            timestamp = datetime.now().strftime("%y_%m_%d_%H_%M_%S")
-            new_filename = os.path.join(backup_dir, f"backup_{self.journal_name}_{timestamp}.db")
-        else:
-            new_filename = os.path.join(backup_dir, self.args.filename)
+        compression = getattr(self.args, "compress", None) or self.config.get("backup_compression")
+        if compression == "default":
+            compression = self.config.get("backup_compression") or "gzip"
+
+        with BackupCatalog(backup_dir) as catalog:
+            parent = None
+            if getattr(self.args, "incremental", False):
+                parent = catalog.latest()
+                page_size = self.connection.execute("PRAGMA page_size").fetchone()[0]
+                if parent is None or parent["page_size"] != page_size or \
+                        not os.path.isfile(os.path.join(backup_dir, parent["filename"])):
+                    self.console.print("No previous backup to build on, making a full backup instead")
+                    parent = None
+
+            extension = INCREMENTAL_EXTENSION if parent else ".db"
+            if compression:
+                extension += COMPRESSION_EXTENSIONS[compression]
+            if self.args.filename is None:
+                timestamp = datetime.now().strftime("%y_%m_%d_%H_%M_%S")
+                new_filename = os.path.join(backup_dir, f"backup_{self.journal_name}_{timestamp}")
+            else:
+                new_filename = os.path.join(backup_dir, strip_backup_extension(self.args.filename))
+            new_filename += extension
 
-        new_filename = new_filename.replace(".db", "") + ".db"
-        self.console.print(f"BACKING UP {self.db_file}\nTO FILE {new_filename}")
-        shutil.copy(self.db_file, new_filename)
+            self.console.print(f"BACKING UP {self.db_file}\nTO FILE {new_filename}")
+            try:
+                if parent:
+                    self.backup_incremental(catalog, parent, new_filename)
+                elif compression:
+                    self.backup_compressed(catalog, new_filename)
+                else:
+                    self.backup_full(catalog, new_filename)
+            except ValueError as error:
+                if os.path.exists(new_filename):
+                    os.remove(new_filename)
+                self.console.print(f"Backup failed: {error}")
+                return
+
+            retention = self.config.get("backup_retention")
+            if retention:
+                self.prune_backups(catalog, backup_dir, retention)
+
+    def backup_full(self, catalog, new_filename):
+        from .utilities.backups import iter_pages, page_digest, page_size_of
+        target = connect(new_filename)
+        try:
+            self.copy_database(self.connection, target)
+        finally:
+            target.close()
+
+        page_size = page_size_of(new_filename)
+        digests = {page_number: page_digest(data) for page_number, data in iter_pages(new_filename, page_size)}
+        catalog.record(new_filename, "full", None, page_size, len(digests), digests, replace_digests=True)
+
+    def backup_compressed(self, catalog, new_filename):
+        # Stream the pages of a read snapshot straight into the compressor, without an uncompressed copy on disk
+        from .utilities.backups import open_archive, page_digest
+        digests = {}
+        with self.snapshot() as (page_size, page_count, pages):
+            with open_archive(new_filename, "wb") as archive:
+                for page_number, data in pages:
+                    digests[page_number] = page_digest(data)
+                    archive.write(data)
+        catalog.record(new_filename, "full", None, page_size, page_count, digests, replace_digests=True)
+
+    def backup_incremental(self, catalog, parent, new_filename):
+        # Keep only the pages whose hash differs from the previous backup
+        from .utilities.backups import page_digest, write_incremental
+        previous = catalog.digests()
+        changed = {}
+        with self.snapshot() as (page_size, page_count, pages):
+            def changed_pages():
+                for page_number, data in pages:
+                    digest = page_digest(data)
+                    if previous.get(page_number) != digest:
+                        changed[page_number] = digest
+                        yield page_number, data
+
+            written = write_incremental(new_filename, page_size, page_count, changed_pages())
+        catalog.record(new_filename, "incremental", parent["id"], page_size, page_count, changed,
+                       replace_digests=False)
+
+        self.console.print(f"STORED {written} OF {page_count} PAGES CHANGED SINCE {parent['filename']}")
+
+    @contextmanager
+    def snapshot(self):
+        # Yield (page_size, page_count, pages) for a consistent copy of the journal. Pages are read from the
+        # journal file under a read transaction; if the journal keeps changing underneath, fall back to copying
+        # it through the backup API into a temporary file first.
+        from .utilities.backups import database_snapshot, iter_pages, page_size_of
+        with database_snapshot(self.db_file) as snapshot:
+            if snapshot is not None:
+                yield snapshot
+                return
+
+        snapshot_file = f"{self.db_file}.snapshot_{os.getpid()}.tmp"
+        target = connect(snapshot_file)
+        try:
+            self.copy_database(self.connection, target)
+        finally:
+            target.close()
+        try:
+            page_size = page_size_of(snapshot_file)
+            yield page_size, os.path.getsize(snapshot_file) // page_size, iter_pages(snapshot_file, page_size)
+        finally:
+            os.remove(snapshot_file)
+
+    def prune_backups(self, catalog, backup_dir, retention):
+        # Delete the backups the retention policy no longer needs, never breaking an incremental chain
+        from .utilities.backups import RETENTION_PERIODS, retained_backups
+        if not isinstance(retention, dict) or any(
+                period not in RETENTION_PERIODS or not isinstance(count, int) or isinstance(count, bool) or count < 0
+                for period, count in retention.items()):
+            self.console.print(f"Invalid backup_retention setting in {self.config_file}: expected counts (0 or more) "
+                               f"for any of {', '.join(RETENTION_PERIODS)}, not pruning backups")
+            exit(1)
+        entries = catalog.entries()
+        keep = retained_backups(entries, retention)
+        pruned = 0
+        for entry in reversed(entries):
+            if entry["id"] in keep:
+                continue
+            path = os.path.join(backup_dir, entry["filename"])
+            if os.path.isfile(path):
+                os.remove(path)
+            catalog.remove(entry["id"])
+            pruned += 1
+        if pruned:
+            self.console.print(f"PRUNED {pruned} BACKUP{'S' if pruned != 1 else ''} (RETENTION {retention})")
 
     def restore(self):
+        from .utilities.backups import BackupCatalog, CATALOG_NAME, COMPRESSION_EXTENSIONS, strip_backup_extension
         backup_dir = os.path.join(self.journal_dir, "backups", self.journal_name)
 
+        chain = None
+        if os.path.isfile(os.path.join(backup_dir, CATALOG_NAME)):
+            with BackupCatalog(backup_dir) as catalog:
+                if getattr(self.args, "list", False):
+                    self.list_backups(catalog)
+                    return
+                if self.args.filename is not None:
+                    entry = catalog.find(self.args.filename)
+                elif getattr(self.args, "at", None):
+                    entry = catalog.at(parse_timestamp(self.args.at))
+                    if entry is None:
+                        self.console.print(f"Failed to restore backup: no backup from before {self.args.at}.")
+                        return
+                else:
+                    entry = catalog.latest()
+                try:
+                    chain = catalog.chain(entry) if entry else None
+                except ValueError as error:
+                    self.console.print(f"Failed to restore backup: {error}.")
+                    return
+
+        if chain:
+            self.restore_chain(backup_dir, chain)
+            return
+
+        # Backups made before the catalog existed
         if self.args.filename is None:
-            filename = get_newest_file(backup_dir)
+            filename = get_newest_file(backup_dir, extensions=[".db"] + [".db" + extension for extension in
+                                                                         COMPRESSION_EXTENSIONS.values()])
         else:
             filename = os.path.join(backup_dir, self.args.filename)
+            stem = strip_backup_extension(filename)
+            for extension in [""] + list(COMPRESSION_EXTENSIONS.values()):
+                if not os.path.isfile(filename):
+                    filename = stem + ".db" + extension
 
-        if filename and os.path.exists(filename.replace(".db", "") + ".db"):
-            filename = filename.replace(".db", "") + ".db"
-            self.console.print(f"RESTORING BACKUP FROM {filename}\nREPLACING {self.db_file}")
-            shutil.copy(filename, self.db_file)
-            # self.db_file = filename
+        if filename and os.path.isfile(filename):
+            self.restore_chain(backup_dir, [{"filename": os.path.basename(filename)}])
         else:
             self.console.print(f"Failed to restore backup: file not found.")
 
-    def load(self):
+    def restore_chain(self, backup_dir, chain):
+        import lzma
+        import shutil
+        from .utilities.backups import apply_incremental, open_archive, strip_backup_extension
+        paths = [os.path.join(backup_dir, entry["filename"]) for entry in chain]
+        missing = [path for path in paths if not os.path.isfile(path)]
+        if missing:
+            self.console.print(f"Failed to restore backup: file not found: {missing[0]}")
+            return
+
+        self.console.print(f"RESTORING BACKUP FROM {paths[-1]}\nREPLACING {self.db_file}")
+        restored_file = paths[0]
+        if len(paths) > 1 or strip_backup_extension(paths[0]) + ".db" != paths[0]:
+            # Rebuild the point in time by decompressing the full backup and patching it with each incremental
+            restored_file = os.path.join(backup_dir, f".restore_{os.getpid()}.tmp")
+            try:
+                with open_archive(paths[0], "rb") as archive, open(restored_file, "wb") as database:
+                    shutil.copyfileobj(archive, database, 1024 * 1024)
+                for path in paths[1:]:
+                    apply_incremental(restored_file, path)
+            except (OSError, ValueError, EOFError, lzma.LZMAError) as error:
+                os.remove(restored_file)
+                self.console.print(f"Failed to restore backup: {error}")
+                return
+
+        # Copy into the open journal connection so SQLite locking protects other sj processes
+        source = connect(restored_file)
+        try:
+            self.copy_database(source, self.connection)
+        finally:
+            source.close()
+            if restored_file != paths[0]:
+                os.remove(restored_file)
+
+    def list_backups(self, catalog):
+        for entry in catalog.entries():
+            created = datetime.fromtimestamp(entry["created"]).strftime("%m-%d-%y %H:%M:%S")
+            self.console.print(f"{created}  {entry['kind']:<11}  {entry['filename']}")
+
+    def copy_database(self, source, target):
+        # Consistent online copy through the SQLite backup API. The source is only locked while each
+        # step of pages is copied, so other sj processes can keep writing between steps; if they do,
+        # SQLite restarts the copy so the result is still a snapshot.
+        pages = self.config.get("backup_pages_per_step", 1024)
+        sleep = self.config.get("backup_step_sleep", 0.005)
+
+        if not self.console.is_terminal:
+            source.backup(target, pages=pages, sleep=sleep)
+            return
+
+        from rich.progress import Progress
+
+        with Progress(console=self.console, transient=True) as progress:
+            task = progress.add_task("Copying pages", total=None)
+
+            def report(status, remaining, total):
+                progress.update(task, completed=total - remaining, total=total)
+
+            source.backup(target, pages=pages, progress=report, sleep=sleep)
+
+    def daemon(self):
+        from .utilities.daemon import serve, socket_path, stop
+        path = self.args.socket or socket_path()
+        if self.args.stop:
+            if stop(path):
+                self.console.print(f"STOPPED DAEMON ON {path}")
+            else:
+                self.console.print(f"No daemon is listening on {path}")
+            return
 
-        # Create sjournal directory in user home directory if it does not exist
-        sjournal_dir = os.path.join(self.user_home_dir, "sjournal")
-        if not os.path.isdir(sjournal_dir):
-            os.makedirs(sjournal_dir)
+        connections = {}
+        self.console.print(f"LISTENING ON {path}")
+        try:
+            serve(path, lambda request, output: SJournal.serve_request(request, output, connections))
+        except KeyboardInterrupt:
+            pass
+        except OSError as error:
+            self.console.print(f"Failed to start daemon: {error}")
+        finally:
+            for connection in connections.values():
+                connection.close()
+
+    @classmethod
+    def serve_request(cls, request, output, connections):
+        # Run one client command inside the daemon, rendering for the client's terminal
+        try:
+            with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+                args = parse_args(request["argv"])
+        except SystemExit:
+            # Usage errors and help are printed by the client
+            return None
+        if args.command not in cls.daemon_commands or args.debug or args.version or \
+                getattr(args, "pager", False) or (args.command == "add" and not args.content):
+            return None
+        args.no_gui = True
 
-        # Create default config file if it does not exist
-        if not os.path.isfile(self.config_file):
-            self.console.print(f"No config file found. Creating new one at {self.config_file}")
+        from rich.console import Console
 
-            config = {
-                "journal_dir": os.path.join(self.user_home_dir, "sjournal", "journals"),
-                "journal_name": "notes"
-            }
+        color_system = None
+        if request["tty"] and not request["no_color"]:
+            if request["colorterm"] in ("truecolor", "24bit"):
+                color_system = "truecolor"
+            elif "256" in request["term"]:
+                color_system = "256"
+            else:
+                color_system = "standard"
+        console = Console(file=output, width=request["width"], force_terminal=request["tty"],
+                          color_system=color_system, no_color=request["no_color"])
 
-            confstring = json.dumps(config)
-            with open(self.config_file, "w") as config_file:
-                config_file.write(confstring)
+        try:
+            journal = cls(args)
+            journal.console = console
+            journal.output = output
+            journal.shared_connections = connections
+            journal.run()
+        except SystemExit as error:
+            return error.code if isinstance(error.code, int) else int(error.code is not None)
+        except Exception:
+            console.print_exception()
+            return 1
+        return 0
 
-        # Modify the config file to use the specified journal name if given
-        if hasattr(self.args, 'journal_name'):
-            with open(self.config_file, "r") as config_file:
-                config = json.load(config_file)
+    def load(self):
+        config = load_config(self.config_file)
 
+        # First run: create the sjournal directories and a default config file
+        if config is None:
+            self.console.print(f"No config file found. Creating new one at {self.config_file}")
+            config = default_config(self.user_home_dir)
+            os.makedirs(config["journal_dir"], exist_ok=True)
+            save_config(self.config_file, config)
+
+        # Switch to the specified journal if given, writing the config only if it changes
+        if hasattr(self.args, 'journal_name'):
             config["journal_name"] = self.args.journal_name
-            confstring = json.dumps(config)
-            with open(self.config_file, "w") as config_file:
-                config_file.write(confstring)
+            save_config(self.config_file, config)
+            os.makedirs(config["journal_dir"], exist_ok=True)
 
             msg = f'Set journal to {os.path.join(config["journal_dir"], config["journal_name"])}.db'
             self.console.print(msg)
 
-            # Load the new config
-            with open(self.config_file, "r") as config_file:
-                config = json.load(config_file)
-
-        # If journal name is not given, use the file specified in the config file
-        else:
-            with open(self.config_file, "r") as config_file:
-                config = json.load(config_file)
-
-        # If the journal directory does not exist, create it
-        if not os.path.exists(os.path.join(config["journal_dir"])):
-            os.makedirs(os.path.join(config["journal_dir"]))
-
         # Set the db_file, journal_dir, and journal_name attributes for the journal object
         self.db_file = os.path.join(config["journal_dir"], f"{config['journal_name']}.db")
         self.journal_dir = config["journal_dir"]
         self.journal_name = config["journal_name"]
+        self.config = config
 
     @property
     def notes(self):
-        return self._get_notes()
+        return list(self.iter_notes())
 
     @property
     def length(self):
         return self._get_length()
 
     def _get_length(self):
-        return len(self.notes)
+        return self.new_cursor().execute("SELECT count(*) FROM notes").fetchone()[0]
 
-    def _get_notes(self):
-        query = "SELECT * FROM notes"
+    def iter_notes(self, category=None, ids=None, since=None, until=None, batch_size=1000):
+        # Yield the journal's notes in ID order, reading batch_size rows at a time. Takes the same filters as
+        # "sjournal list"; the connection stays open for further calls.
+        where, params = self.build_filters(category=category, ids=ids, since=since, until=until)
         cursor = self.new_cursor()
-        cursor.execute(query)
-        items = cursor.fetchall()
-        notes = []
-        for item in items:
-            notes.append(Note(item[0], item[2], item[3], date_time=datetime.strptime(item[1], "%m-%d-%y %H:%M:%S")))
-        self.close_connection()
-
-        return notes
+        cursor.execute("SELECT * FROM note_rows" + where + " ORDER BY id", params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield Note.from_row(row)
 
 
 class Note:
+    # Journals can hold millions of notes, so notes have no per-instance __dict__ and only convert their
+    # timestamp (stored as epoch seconds) to a datetime and display string when they are asked for
+    __slots__ = ("id", "category", "content", "_epoch", "_date_time", "_timestamp")
+
     def __init__(self, id, category, content, date_time=None):
         self.id = id
         self.category = category
         self.content = content
-        if not date_time:
-            self.date_time = datetime.now()
-        else:
-            self.date_time = date_time
-        self.timestamp = datetime.strftime(self.date_time, "%m-%d-%y %H:%M:%S")
+        self._date_time = date_time or datetime.now()
+        self._epoch = None
+        self._timestamp = None
+
+    @classmethod
+    def from_row(cls, row):
+        # Rows are (id, timestamp, category, content) with the timestamp stored as epoch seconds
+        note = cls.__new__(cls)
+        note.id, note._epoch, note.category, note.content = row
+        note._date_time = None
+        note._timestamp = None
+        return note
+
+    @property
+    def date_time(self):
+        if self._date_time is None:
+            self._date_time = datetime.fromtimestamp(self._epoch)
+        return self._date_time
+
+    @date_time.setter
+    def date_time(self, date_time):
+        self._date_time = date_time
+        self._epoch = None
+        self._timestamp = None
+
+    @property
+    def timestamp(self):
+        if self._timestamp is None:
+            self._timestamp = self.date_time.strftime("%m-%d-%y %H:%M:%S")
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, timestamp):
+        # Accepts anything parse_timestamp reads, e.g. "03-20-22 15:30:55"; date_time and epoch follow
+        self._epoch = parse_timestamp(timestamp)
+        self._date_time = None
+        self._timestamp = None
+
+    @property
+    def epoch(self):
+        if self._epoch is None:
+            self._epoch = int(self._date_time.timestamp())
+        return self._epoch
+
+    @property
+    def record(self):
+        # Values as stored in the notes table
+        return dict(self.dict, timestamp=self.epoch)
 
     @property
     def dict(self):
@@ -467,15 +1388,23 @@ class Note:
         return self.id == other.id and \
                self.category == other.category and \
                self.content == other.content and \
-               self.timestamp == other.timestamp
+               self.epoch == other.epoch
 
 
-def main():
+def main(headless=False):
     args = parse_args()
+    if headless:
+        args.no_gui = True
 
     if args.version:
         print(f"sjournal v{__version__} (Made by Sam Stuver)")
 
     else:
         journal = SJournal(args)
-        journal.run()
\ No newline at end of file
+        journal.run()
+
+
+def main_headless():
+    # Entry point for shell and git hooks: never imports the GUI stack
+    main(headless=True)
+
@@ -1,7 +1,45 @@
 import argparse
 
+from .transfer import FORMATS, EXPORT_FORMATS, OUTPUT_FORMATS
 
-def parse_args():
+
+def add_filter_arguments(parser):
+    # Filters shared by list and export
+    parser.add_argument('-c', '--category', nargs='?', default=None, action='store',
+                        help="Only include notes in the given category")
+    parser.add_argument('-i', '--ids', nargs='+', default=None, action='store',
+                        help="Only include the given note IDs or ranges (e.g. 3 7-9 12-)")
+    add_date_arguments(parser)
+
+
+def add_date_arguments(parser):
+    # Date range shared by list, search, export and delete, served by the timestamp index
+    parser.add_argument('--since', default=None, action='store',
+                        help="Only include notes written at or after this date/time (e.g. 2022, 2022-03-20, "
+                             "2022-03-20T15:30, or 7d, 3h, 2w, 30m ago)")
+    parser.add_argument('--until', default=None, action='store',
+                        help="Only include notes written before this date/time (absolute or relative, like --since)")
+
+
+def add_page_arguments(parser):
+    # Paging shared by list and search
+    parser.add_argument('--before', type=int, default=None, metavar='ID',
+                        help="Only show notes with an ID below this one (the next page of older notes)")
+    parser.add_argument('--after', type=int, default=None, metavar='ID',
+                        help="Only show notes with an ID above this one (the next page of newer notes)")
+    parser.add_argument('--page', type=int, default=None,
+                        help="Show this page of results, counting from 1")
+    parser.add_argument('--page-size', type=int, default=None,
+                        help="Number of notes per page")
+
+
+def add_format_argument(parser):
+    # Machine-readable output shared by list, search and categories
+    parser.add_argument('--format', default=None, choices=OUTPUT_FORMATS,
+                        help="Write plain rows for scripts instead of a table (tsv, json, jsonl or plain)")
+
+
+def parse_args(argv=None):
 
     # Read environment from command line args
     parser = argparse.ArgumentParser()
@@ -9,6 +47,8 @@ def parse_args():
     subparsers = parser.add_subparsers(dest='command', help='Commands', title='Commands')
     parser.add_argument('-d', '--debug', action='store_true', help="Output to reports/debug.log instead of stdout")
     parser.add_argument('-v', '--version', action='store_true', help="Show sjournal information")
+    parser.add_argument('--no-gui', action='store_true',
+                        help="Never open the note editor window (for scripts and hooks)")
 
     # Add command
     parser_add = subparsers.add_parser('add', help='Add a note to the database')
@@ -23,14 +63,30 @@ def parse_args():
     parser_backup = subparsers.add_parser('backup', help='Backup the current journal')
     parser_backup.add_argument('-f', '--filename', action='store', default=None,
                                help='Choose a filename to use for the backup file. By default, the current timestamp will be used')
+    parser_backup.add_argument('-i', '--incremental', action='store_true',
+                               help='Only store the pages that changed since the previous backup')
+    parser_backup.add_argument('-z', '--compress', nargs='?', const='default', default=None,
+                               choices=['default', 'gzip', 'lzma', 'zstd'],
+                               help='Compress the backup (gzip, lzma, or zstd; defaults to backup_compression from the config, or gzip)')
 
     # Categories command
     parser_categories = subparsers.add_parser('categories', help="List all categories in the current journal")
     parser_categories.add_argument('-s', '--search', nargs="?", action='store', type=str)
+    add_format_argument(parser_categories)
+
+    # Daemon command
+    parser_daemon = subparsers.add_parser('daemon', help='Serve commands from a background process to make them faster (use with sjc)')
+    parser_daemon.add_argument('--socket', action='store', default=None,
+                               help='Unix socket to listen on (default: ~/sjournal/daemon.sock)')
+    parser_daemon.add_argument('--stop', action='store_true', help='Stop the running daemon')
 
     # Delete command
     parser_delete = subparsers.add_parser('delete', help='Delete one or multiple notes from the database')
-    parser_delete.add_argument('delete_criteria', nargs='*', action='store', type=str)
+    parser_delete.add_argument('delete_criteria', nargs='*', action='store', type=str,
+                               help="IDs or ranges of notes to delete (e.g. 3 7-9 -2 12-)")
+    add_date_arguments(parser_delete)
+    parser_delete.add_argument('--verbose', action='store_true',
+                               help="Print the ID of every deleted note")
 
     # Edit command
     parser_edit = subparsers.add_parser('edit', help='Edit a note to the database')
@@ -40,10 +96,31 @@ def parse_args():
     # Erase command
     parser_erase = subparsers.add_parser('erase', help='Delete all notes from the current journal')
 
+    # Export command
+    parser_export = subparsers.add_parser('export', help='Export notes to JSONL, CSV or Markdown')
+    parser_export.add_argument('-o', '--output', dest='filename', action='store', default=None,
+                               help="File to write. If not given (or '-'), notes are written to stdout")
+    parser_export.add_argument('-f', '--format', choices=EXPORT_FORMATS, default=None,
+                               help="Output format. By default it is guessed from the file extension, JSONL otherwise")
+    parser_export.add_argument('-b', '--batch-size', default=1000, action='store', type=int,
+                               help="Number of notes read from the database at a time")
+    add_filter_arguments(parser_export)
+
     # Help command
     parser_help = subparsers.add_parser('help', help='Display help text')
     parser_help.add_argument('help_command', nargs='?', action='store', default=None)
 
+    # Import command
+    parser_import = subparsers.add_parser('import', help='Import notes from a JSONL, CSV or plain text file')
+    parser_import.add_argument('filename', nargs='?', action='store', default=None,
+                               help="File to import. If not given (or '-'), notes are read from stdin")
+    parser_import.add_argument('-f', '--format', choices=FORMATS, default=None,
+                               help="Input format. By default it is guessed from the file extension, plain lines otherwise")
+    parser_import.add_argument('-c', '--category', default='General', action='store',
+                               help="Category for notes that do not specify one")
+    parser_import.add_argument('-b', '--batch-size', default=1000, action='store', type=int,
+                               help="Number of notes sent to the database per batch")
+
     # List command
     parser_list = subparsers.add_parser('list', help='List notes in the database')
     parser_list.add_argument('quantity', nargs='*', action='store', default=5, type=int,
@@ -52,10 +129,13 @@ def parse_args():
     parser_list.add_argument('-a', '--all', action='store_true',
                              help="List all notes under given criteria")
 
-    parser_list.add_argument('-c', '--category', nargs='?', default=None, action='store',
-                             help="Choose a category of notes to list")
     parser_list.add_argument('-r', '--reverse', action='store_true',
                              help="Display notes in reverse chronological order")
+    parser_list.add_argument('-p', '--pager', action='store_true',
+                             help="Show the notes in a pager ($PAGER, or less)")
+    add_filter_arguments(parser_list)
+    add_page_arguments(parser_list)
+    add_format_argument(parser_list)
 
     # Load command
     parser_load = subparsers.add_parser('load', help="Load a journal or create a new one if it doesn't exist")
@@ -65,24 +145,57 @@ def parse_args():
     parser_restore = subparsers.add_parser('restore', help='Restore the database from a file. If --filename is not given, restore the latest backup')
     parser_restore.add_argument('-f', '--filename', action='store', default=None,
                                help='Specify a file to backup data from. If not specified, the latest backup file will be used')
+    parser_restore.add_argument('--at', action='store', default=None,
+                                help='Restore the journal as it was at this date/time (the newest backup taken before it)')
+    parser_restore.add_argument('-l', '--list', action='store_true',
+                                help='List the available backups instead of restoring')
 
     # Search command
     parser_search = subparsers.add_parser('search', help='List notes matching search term')
-    parser_search.add_argument('search_criteria', nargs='+', action='store', type=str)
-
-    args = parser.parse_args()
+    parser_search.add_argument('search_criteria', nargs='+', action='store', type=str,
+                               help='Words to search for. Words match as prefixes, "quoted phrases" match exactly, '
+                                    'anything else is treated as a regular expression')
+    parser_search.add_argument('-c', '--category', default=None, action='store',
+                               help="Only search notes in the given category")
+    parser_search.add_argument('-q', '--quantity', default=None, action='store', type=int,
+                               help="Show at most this many matches")
+    parser_search.add_argument('-x', '--regex', action='store_true',
+                               help="Treat the search criteria as a regular expression")
+    parser_search.add_argument('-p', '--pager', action='store_true',
+                               help="Show the matches in a pager ($PAGER, or less)")
+    parser_search.add_argument('--all-journals', action='store_true',
+                               help="Search every journal in journal_dir, newest matches first")
+    add_date_arguments(parser_search)
+    add_page_arguments(parser_search)
+    add_format_argument(parser_search)
+
+    # Update command
+    parser_update = subparsers.add_parser('update', help='Change the category or style of many notes at once')
+    parser_update.add_argument('-i', '--ids', nargs='+', default=None, action='store',
+                               help="IDs or ranges of the notes to change (e.g. 3 7-9 12-)")
+    add_date_arguments(parser_update)
+    parser_update.add_argument('-c', '--category', default=None, action='store',
+                               help="Move the notes to this category")
+    parser_update.add_argument('-s', '--style', default=None, action='store',
+                               help='Give the notes this rich console markup style ("" removes their style)')
+
+    args = parser.parse_args(argv)
     parsers = {
         'add':parser_add,
         'backup': parser_backup,
         'categories': parser_categories,
+        'daemon': parser_daemon,
         'delete': parser_delete,
         'edit':parser_edit,
         'erase': parser_erase,
+        'export': parser_export,
         'help': parser_help,
+        'import': parser_import,
         'list': parser_list,
         'load': parser_load,
         'restore':parser_restore,
         'search':parser_search,
+        'update': parser_update,
     }
 
     if args.command == "help":
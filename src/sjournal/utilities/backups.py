@@ -0,0 +1,257 @@
+import gzip
+import hashlib
+import lzma
+import os
+import re
+import struct
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from sqlite3 import connect
+
+# Incremental backups work on database pages: a full backup is a plain copy of the journal, and each
+# incremental backup stores only the pages that differ from the previous backup in the chain. A small
+# SQLite catalog next to the backup files records the chain and the page hashes of the latest backup,
+# so neither backing up nor restoring has to scan the backup directory.
+
+CATALOG_NAME = "catalog.db"
+INCREMENTAL_EXTENSION = ".sjinc"
+INCREMENTAL_MAGIC = b"SJINC1\n"
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "lzma": ".xz", "zstd": ".zst"}
+
+# Period keys of a backup_retention policy, mapped to the bucket a backup's creation time falls in
+RETENTION_PERIODS = {
+    "hourly": lambda created: datetime.fromtimestamp(created).strftime("%Y-%m-%d %H"),
+    "daily": lambda created: datetime.fromtimestamp(created).strftime("%Y-%m-%d"),
+    "weekly": lambda created: datetime.fromtimestamp(created).isocalendar()[:2],
+    "monthly": lambda created: datetime.fromtimestamp(created).strftime("%Y-%m"),
+}
+
+_HEADER = struct.Struct(">IQ")
+_PAGE_NUMBER = struct.Struct(">Q")
+
+
+def strip_backup_extension(filename):
+    return re.sub(r"(\.db|\.sjinc)?(\.gz|\.xz|\.zst)?$", "", filename)
+
+
+def open_archive(path, mode):
+    # Open a backup file in binary mode, compressing or decompressing on the fly according to its extension
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    if path.endswith(".xz"):
+        return lzma.open(path, mode)
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd compression needs the zstandard package (pip install zstandard)")
+        if "w" in mode:
+            return zstandard.ZstdCompressor().stream_writer(open(path, mode), closefd=True)
+        return zstandard.ZstdDecompressor().stream_reader(open(path, mode), closefd=True)
+    return open(path, mode)
+
+
+def read_exact(stream, size):
+    # Decompressing readers may return short reads before the end of the stream
+    data = stream.read(size)
+    while data and len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+@contextmanager
+def database_snapshot(db_file, attempts=5):
+    # Hold one read transaction on the journal and yield (page_size, page_count, pages) where pages reads the
+    # database file as of that transaction. A WAL journal is checkpointed first; the snapshot is only taken once
+    # the WAL is empty, so the main file holds every committed page and later checkpoints cannot change it.
+    # Yields None if writers keep the WAL busy for every attempt.
+    reader = connect(db_file, isolation_level=None)
+    try:
+        for _ in range(attempts):
+            reader.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            reader.execute("BEGIN")
+            reader.execute("SELECT count(*) FROM sqlite_master").fetchone()
+            wal_file = db_file + "-wal"
+            if not os.path.exists(wal_file) or os.path.getsize(wal_file) == 0:
+                break
+            reader.execute("ROLLBACK")
+            time.sleep(0.05)
+        else:
+            yield None
+            return
+
+        page_size = reader.execute("PRAGMA page_size").fetchone()[0]
+        page_count = reader.execute("PRAGMA page_count").fetchone()[0]
+
+        def pages():
+            for page_number, data in iter_pages(db_file, page_size):
+                if page_number > page_count:
+                    break
+                yield page_number, data
+
+        yield page_size, page_count, pages()
+    finally:
+        reader.close()
+
+
+def page_size_of(path):
+    # The page size is stored in bytes 16-17 of the database header (1 means 65536)
+    with open(path, "rb") as database:
+        header = database.read(100)
+    size = struct.unpack(">H", header[16:18])[0]
+    return 65536 if size == 1 else size
+
+
+def iter_pages(path, page_size):
+    # Yield (page_number, data) for every page of a database file, numbered from 1
+    with open(path, "rb") as database:
+        page_number = 1
+        while True:
+            data = database.read(page_size)
+            if not data:
+                break
+            yield page_number, data
+            page_number += 1
+
+
+def page_digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def write_incremental(path, page_size, page_count, pages):
+    # pages: iterable of (page_number, data). Returns the number of pages written.
+    written = 0
+    with open_archive(path, "wb") as incremental:
+        incremental.write(INCREMENTAL_MAGIC)
+        incremental.write(_HEADER.pack(page_size, page_count))
+        for page_number, data in pages:
+            incremental.write(_PAGE_NUMBER.pack(page_number))
+            incremental.write(data)
+            written += 1
+    return written
+
+
+def apply_incremental(database_path, incremental_path):
+    # Patch a full database copy in place with the pages stored in an incremental backup
+    with open_archive(incremental_path, "rb") as incremental, open(database_path, "r+b") as database:
+        if read_exact(incremental, len(INCREMENTAL_MAGIC)) != INCREMENTAL_MAGIC:
+            raise ValueError(f"{incremental_path} is not an sjournal incremental backup")
+        page_size, page_count = _HEADER.unpack(read_exact(incremental, _HEADER.size))
+        while True:
+            number = read_exact(incremental, _PAGE_NUMBER.size)
+            if not number:
+                break
+            page_number = _PAGE_NUMBER.unpack(number)[0]
+            database.seek((page_number - 1) * page_size)
+            database.write(read_exact(incremental, page_size))
+        database.truncate(page_count * page_size)
+
+
+def retained_backups(entries, policy):
+    # IDs of the backups a retention policy such as {"hourly": 24, "daily": 7, "weekly": 4} keeps: the newest
+    # backup of each of the last N hours/days/weeks that have backups, the latest backup, and every backup
+    # those depend on
+    newest_first = sorted(entries, key=lambda entry: (entry["created"], entry["id"]), reverse=True)
+    keep = set(entry["id"] for entry in newest_first[:1])
+    for period, count in policy.items():
+        buckets = []
+        for entry in newest_first:
+            bucket = RETENTION_PERIODS[period](entry["created"])
+            if bucket not in buckets:
+                if len(buckets) >= count:
+                    break
+                buckets.append(bucket)
+                keep.add(entry["id"])
+
+    parents = {entry["id"]: entry["parent_id"] for entry in entries}
+    for entry_id in list(keep):
+        while parents.get(entry_id) is not None:
+            entry_id = parents[entry_id]
+            keep.add(entry_id)
+    return keep
+
+
+class BackupCatalog:
+    def __init__(self, backup_dir):
+        self.backup_dir = backup_dir
+        self.connection = connect(os.path.join(backup_dir, CATALOG_NAME))
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS backups(
+                    id integer PRIMARY KEY, filename text UNIQUE, kind text, parent_id integer,
+                    created real, page_size integer, page_count integer);
+                CREATE INDEX IF NOT EXISTS backups_created ON backups(created);
+                CREATE TABLE IF NOT EXISTS page_hashes(page_number integer PRIMARY KEY, digest blob);
+            """)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _entry(self, query, params=()):
+        row = self.connection.execute(query, params).fetchone()
+        if row is None:
+            return None
+        keys = ["id", "filename", "kind", "parent_id", "created", "page_size", "page_count"]
+        return dict(zip(keys, row))
+
+    def latest(self):
+        return self._entry("SELECT * FROM backups ORDER BY created DESC, id DESC LIMIT 1")
+
+    def find(self, filename):
+        # Backups can be named with or without their extensions
+        filename = os.path.basename(filename)
+        stem = strip_backup_extension(filename)
+        names = [filename] + [stem + kind + compression for kind in (".db", INCREMENTAL_EXTENSION)
+                              for compression in [""] + list(COMPRESSION_EXTENSIONS.values())]
+        return self._entry(f"SELECT * FROM backups WHERE filename IN ({', '.join('?' * len(names))}) "
+                           "ORDER BY created DESC LIMIT 1", names)
+
+    def at(self, timestamp):
+        # Newest backup taken at or before the given epoch time
+        return self._entry("SELECT * FROM backups WHERE created <= ? ORDER BY created DESC, id DESC LIMIT 1",
+                           (timestamp,))
+
+    def entries(self):
+        keys = ["id", "filename", "kind", "parent_id", "created", "page_size", "page_count"]
+        return [dict(zip(keys, row)) for row in self.connection.execute("SELECT * FROM backups ORDER BY created, id")]
+
+    def chain(self, entry):
+        # The full backup an entry is based on, followed by every incremental up to the entry
+        chain = [entry]
+        while chain[0]["parent_id"] is not None:
+            parent = self._entry("SELECT * FROM backups WHERE id = ?", (chain[0]["parent_id"],))
+            if parent is None:
+                raise ValueError(f"the backup {chain[0]['filename']} is based on was replaced or removed")
+            chain.insert(0, parent)
+        return chain
+
+    def remove(self, entry_id):
+        with self.connection:
+            self.connection.execute("DELETE FROM backups WHERE id = ?", (entry_id,))
+
+    def digests(self):
+        return dict(self.connection.execute("SELECT page_number, digest FROM page_hashes"))
+
+    def record(self, filename, kind, parent_id, page_size, page_count, digests, replace_digests):
+        # Add a backup to the catalog and store the page hashes of the journal as it was backed up
+        with self.connection:
+            self.connection.execute("DELETE FROM backups WHERE filename = ?", (os.path.basename(filename),))
+            cursor = self.connection.execute(
+                "INSERT INTO backups (filename, kind, parent_id, created, page_size, page_count) VALUES (?, ?, ?, ?, ?, ?)",
+                (os.path.basename(filename), kind, parent_id, time.time(), page_size, page_count))
+            if replace_digests:
+                self.connection.execute("DELETE FROM page_hashes")
+            else:
+                self.connection.execute("DELETE FROM page_hashes WHERE page_number > ?", (page_count,))
+            self.connection.executemany("INSERT OR REPLACE INTO page_hashes VALUES (?, ?)", digests.items())
+        return cursor.lastrowid
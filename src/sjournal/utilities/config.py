@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+
+# sjournal_config.json is read on every command, and many sj processes may use it at once. Reads are cached
+# per process and only repeated when the file's mtime or size changes; writes only happen when a value
+# actually changed, and go through a temporary file renamed into place so readers never see a partial file.
+
+_cache = {}
+
+
+def default_config(home_dir):
+    return {
+        "journal_dir": os.path.join(home_dir, "sjournal", "journals"),
+        "journal_name": "notes",
+        "backup_pages_per_step": 1024,
+        "backup_step_sleep": 0.005,
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "busy_timeout": 5000
+    }
+
+
+def load_config(path):
+    # Returns a copy of the config, or None if the file does not exist
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        _cache.pop(path, None)
+        return None
+
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _cache.get(path)
+    if cached is None or cached[0] != signature:
+        with open(path, "r") as config_file:
+            cached = (signature, json.load(config_file))
+        _cache[path] = cached
+    return dict(cached[1])
+
+
+def save_config(path, config):
+    # Returns True if the file was written, False if it already held this config
+    if load_config(path) == config:
+        return False
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(prefix=".sjournal_config_", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(handle, "w") as config_file:
+            config_file.write(json.dumps(config))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    _cache.pop(path, None)
+    return True
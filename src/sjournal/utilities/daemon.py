@@ -0,0 +1,154 @@
+import json
+import os
+import shutil
+import socket
+import struct
+import sys
+
+# "sjournal daemon" keeps an interpreter with sjournal, rich and open journal connections loaded, and serves
+# commands over a Unix domain socket. Client and daemon exchange frames of a one-byte type, a 4-byte length
+# and a payload. The client sends one "r" (request) frame; the daemon answers with "o" (output) frames and a
+# final "x" (exit status) frame, or a single "l" frame when the command has to run in the client instead.
+
+_FRAME = struct.Struct(">cI")
+
+
+def socket_path():
+    return os.path.join(os.path.expanduser("~"), "sjournal", "daemon.sock")
+
+
+def send_frame(sock, kind, payload=b""):
+    sock.sendall(_FRAME.pack(kind, len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def recv_frame(sock):
+    header = _recv_exact(sock, _FRAME.size)
+    if header is None:
+        return None, None
+    kind, length = _FRAME.unpack(header)
+    return kind, _recv_exact(sock, length) if length else b""
+
+
+class FrameWriter:
+    # Text stream that sends everything written to it to the client as output frames
+    def __init__(self, sock):
+        self.sock = sock
+
+    def write(self, text):
+        if text:
+            send_frame(self.sock, b"o", text.encode("utf-8"))
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def _connect(path):
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError:
+        client.close()
+        return None
+    return client
+
+
+def forward(path, argv, stream=None):
+    # Run a command in the daemon and copy its output to stream (stdout by default). Returns the exit status,
+    # or None if no daemon is listening or the command has to run locally.
+    stream = stream or sys.stdout
+    client = _connect(path)
+    if client is None:
+        return None
+
+    with client:
+        request = {
+            "argv": argv,
+            "width": shutil.get_terminal_size().columns,
+            "tty": stream.isatty(),
+            "term": os.environ.get("TERM", ""),
+            "colorterm": os.environ.get("COLORTERM", ""),
+            "no_color": "NO_COLOR" in os.environ,
+        }
+        send_frame(client, b"r", json.dumps(request).encode("utf-8"))
+
+        while True:
+            kind, payload = recv_frame(client)
+            if kind == b"o":
+                stream.write(payload.decode("utf-8"))
+            elif kind == b"x":
+                stream.flush()
+                return int(payload)
+            elif kind == b"l":
+                return None
+            else:
+                # The daemon went away part way through; running the command again could repeat it
+                print("sjournal daemon closed the connection", file=sys.stderr)
+                return 1
+
+
+def stop(path):
+    # Ask a running daemon to exit. Returns False if none is listening.
+    client = _connect(path)
+    if client is None:
+        return False
+    with client:
+        send_frame(client, b"r", json.dumps({"stop": True}).encode("utf-8"))
+        recv_frame(client)
+    return True
+
+
+def serve(path, handle):
+    # Serve requests one at a time until stopped. handle(request, output) runs a command, writing to the
+    # output stream, and returns its exit status, or None if the client has to run it.
+    if not hasattr(socket, "AF_UNIX"):
+        raise OSError("Unix domain sockets are not available on this platform")
+    probe = _connect(path)
+    if probe is not None:
+        probe.close()
+        raise OSError(f"a daemon is already listening on {path}")
+    if os.path.exists(path):
+        os.remove(path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(path)
+        os.chmod(path, 0o600)
+        server.listen()
+        while True:
+            connection, _ = server.accept()
+            with connection:
+                kind, payload = recv_frame(connection)
+                if kind != b"r":
+                    continue
+                request = json.loads(payload)
+                if request.get("stop"):
+                    send_frame(connection, b"x", b"0")
+                    break
+                try:
+                    status = handle(request, FrameWriter(connection))
+                    if status is None:
+                        send_frame(connection, b"l")
+                    else:
+                        send_frame(connection, b"x", str(status).encode("ascii"))
+                except (BrokenPipeError, ConnectionResetError):
+                    continue
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.remove(path)
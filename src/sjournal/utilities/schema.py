@@ -0,0 +1,147 @@
+from sqlite3 import OperationalError, complete_statement
+
+# Schema migrations for journal databases. PRAGMA user_version stores how many of them have been
+# applied, so opening an up-to-date journal costs a single PRAGMA read.
+
+FTS_TRIGGERS = """
+    CREATE TRIGGER notes_fts_insert AFTER INSERT ON notes BEGIN
+        INSERT INTO notes_fts(rowid, content) VALUES (new.id, new.content);
+    END;
+    CREATE TRIGGER notes_fts_delete AFTER DELETE ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END;
+    CREATE TRIGGER notes_fts_update AFTER UPDATE ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO notes_fts(rowid, content) VALUES (new.id, new.content);
+    END;
+"""
+
+CATEGORY_TRIGGERS = """
+    CREATE TRIGGER categories_count_insert AFTER INSERT ON notes BEGIN
+        UPDATE categories SET note_count = note_count + 1 WHERE id = new.category_id;
+    END;
+    CREATE TRIGGER categories_count_delete AFTER DELETE ON notes BEGIN
+        UPDATE categories SET note_count = note_count - 1 WHERE id = old.category_id;
+    END;
+    CREATE TRIGGER categories_count_update AFTER UPDATE OF category_id ON notes
+    WHEN new.category_id IS NOT old.category_id BEGIN
+        UPDATE categories SET note_count = note_count - 1 WHERE id = old.category_id;
+        UPDATE categories SET note_count = note_count + 1 WHERE id = new.category_id;
+    END;
+"""
+
+MIGRATIONS = [
+    # 1: Original notes table
+    """
+    CREATE TABLE IF NOT EXISTS notes(id integer PRIMARY KEY, timestamp text, category text, content text);
+    """,
+
+    # 2: Full-text index over note content, kept in sync with the notes table by triggers
+    """
+    CREATE VIRTUAL TABLE notes_fts USING fts5(content, content='notes', content_rowid='id');
+    """ + FTS_TRIGGERS + """
+    INSERT INTO notes_fts(notes_fts) VALUES ('rebuild');
+    """,
+
+    # 3: Store timestamps as integer epoch seconds (local "%m-%d-%y %H:%M:%S" text before) and index them.
+    #    Rebuilding the table drops its triggers, so the full-text triggers are recreated.
+    """
+    CREATE TABLE notes_migrated(id integer PRIMARY KEY, timestamp integer, category text, content text);
+    INSERT INTO notes_migrated (id, timestamp, category, content)
+        SELECT id,
+               CAST(strftime('%s', '20' || substr(timestamp, 7, 2) || '-' || substr(timestamp, 1, 2) || '-' ||
+                                   substr(timestamp, 4, 2) || ' ' || substr(timestamp, 10), 'utc') AS integer),
+               category, content
+        FROM notes;
+    DROP TABLE notes;
+    ALTER TABLE notes_migrated RENAME TO notes;
+    CREATE INDEX notes_timestamp ON notes(timestamp);
+    """ + FTS_TRIGGERS,
+
+    # 4: Category filters (ordered by id) and the distinct category listing are served from one index
+    """
+    CREATE INDEX notes_category ON notes(category, id);
+    """,
+
+    # 5: Store each category name once in a categories table with a trigger-maintained note count, and refer to
+    #    it from notes by ID. The note_rows view joins them back into (id, timestamp, category, content) rows.
+    """
+    CREATE TABLE categories(id integer PRIMARY KEY, name text NOT NULL UNIQUE, note_count integer NOT NULL DEFAULT 0);
+    INSERT INTO categories (name, note_count)
+        SELECT coalesce(category, 'General'), count(*) FROM notes GROUP BY coalesce(category, 'General');
+    CREATE TABLE notes_migrated(id integer PRIMARY KEY, timestamp integer, category_id integer NOT NULL, content text);
+    INSERT INTO notes_migrated (id, timestamp, category_id, content)
+        SELECT notes.id, notes.timestamp, categories.id, notes.content
+        FROM notes JOIN categories ON categories.name = coalesce(notes.category, 'General');
+    DROP TABLE notes;
+    ALTER TABLE notes_migrated RENAME TO notes;
+    CREATE INDEX notes_timestamp ON notes(timestamp);
+    CREATE INDEX notes_category ON notes(category_id, id);
+    CREATE VIEW note_rows AS
+        SELECT notes.id AS id, notes.timestamp AS timestamp, categories.name AS category, notes.content AS content
+        FROM notes JOIN categories ON categories.id = notes.category_id;
+    """ + FTS_TRIGGERS + CATEGORY_TRIGGERS,
+
+    # 6: Only reindex a note's content when it changes, not when it moves to another category or time
+    """
+    DROP TRIGGER notes_fts_update;
+    CREATE TRIGGER notes_fts_update AFTER UPDATE OF id, content ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO notes_fts(rowid, content) VALUES (new.id, new.content);
+    END;
+    """,
+]
+
+# Migrations that rebuild the notes table. The old pages are only returned to the file system by a VACUUM.
+REBUILDS = {3, 5}
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def split_statements(script):
+    # The SQL statements of a migration script, so they can run inside a transaction migrate() controls
+    # (executescript would commit it first)
+    statement = ""
+    for part in script.split(";"):
+        statement += part + ";"
+        if complete_statement(statement):
+            if statement.strip(" \n;"):
+                yield statement.strip()
+            statement = ""
+
+
+def migrate(connection):
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+
+    # Several processes may open a new or legacy journal at once. Each migration takes the write lock first and
+    # reads the version again under it, so a migration another process already applied is never repeated.
+    if connection.in_transaction:
+        connection.commit()
+    applied = []
+    legacy = version > 0
+    while True:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                connection.rollback()
+                break
+            number = version + 1
+            for statement in split_statements(MIGRATIONS[number - 1]):
+                connection.execute(statement)
+            connection.execute(f"PRAGMA user_version = {number}")
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        applied.append(number)
+
+    # A new journal has nothing to reclaim
+    if legacy and REBUILDS.intersection(applied):
+        try:
+            connection.execute("VACUUM")
+        except OperationalError:
+            # Another connection is using the journal; the space is reclaimed by a later VACUUM instead
+            pass
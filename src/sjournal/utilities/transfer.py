@@ -0,0 +1,149 @@
+import csv
+import json
+import os
+from datetime import datetime
+
+# Streaming readers used by "sjournal import" and writers used by "sjournal export" and the --format option of
+# list, search and categories. Readers yield one record dict per note, with at least a "content" key. Writers
+# consume (id, timestamp, category, content) rows as they come off the cursor. Neither holds the whole journal
+# in memory.
+
+FORMATS = ["jsonl", "csv", "lines"]
+EXPORT_FORMATS = ["jsonl", "csv", "markdown"]
+OUTPUT_FORMATS = ["tsv", "json", "jsonl", "plain"]
+
+
+def guess_format(filename, default="lines"):
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension in (".jsonl", ".ndjson", ".json"):
+        return "jsonl"
+    if extension == ".csv":
+        return "csv"
+    if extension in (".md", ".markdown"):
+        return "markdown"
+    return default
+
+
+def read_jsonl(stream):
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as error:
+            raise ValueError(f"line {line_number}: {error.msg}")
+        if isinstance(record, str):
+            record = {"content": record}
+        if not isinstance(record, dict):
+            raise ValueError(f"line {line_number}: expected an object or a string, got {json.dumps(record)}")
+        if "content" not in record:
+            raise ValueError(f"line {line_number}: record has no 'content' field")
+        yield record
+
+
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or "content" not in reader.fieldnames:
+        raise ValueError("CSV input needs a header row with a 'content' column")
+    for record in reader:
+        yield {key: value for key, value in record.items() if value not in (None, "")}
+
+
+def read_lines(stream):
+    for line in stream:
+        line = line.rstrip("\r\n")
+        if line.strip():
+            yield {"content": line}
+
+
+def read_records(stream, file_format):
+    readers = {"jsonl": read_jsonl, "csv": read_csv, "lines": read_lines}
+    return readers[file_format](stream)
+
+
+def row_record(row):
+    # Rows from "search --all-journals" carry the journal name as a fifth column
+    note_id, timestamp, category, content = row[:4]
+    record = {
+        "id": note_id,
+        "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
+        "category": category,
+        "content": content,
+    }
+    if len(row) > 4:
+        record["journal"] = row[4]
+    return record
+
+
+def write_jsonl(stream, rows):
+    for row in rows:
+        stream.write(json.dumps(row_record(row)) + "\n")
+
+
+def write_csv(stream, rows):
+    writer = csv.DictWriter(stream, fieldnames=["id", "timestamp", "category", "content"])
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row_record(row))
+
+
+def write_markdown(stream, rows, title=None):
+    if title:
+        stream.write(f"# {title}\n\n")
+    stream.write("| ID | Timestamp | Category | Content |\n")
+    stream.write("|---:|---|---|---|\n")
+    for row in rows:
+        record = row_record(row)
+        cells = [str(record["id"]), record["timestamp"].replace("T", " "), record["category"], record["content"]]
+        cells = [cell.replace("|", "\\|").replace("\r\n", "<br>").replace("\n", "<br>") for cell in cells]
+        stream.write(f"| {' | '.join(cells)} |\n")
+
+
+def write_records(stream, rows, file_format, title=None):
+    if file_format == "markdown":
+        write_markdown(stream, rows, title)
+    elif file_format == "csv":
+        write_csv(stream, rows)
+    else:
+        write_jsonl(stream, rows)
+
+
+def tsv_field(value):
+    # Escape the characters that would break a TSV line, as in PostgreSQL's text format
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def write_output(stream, rows, output_format):
+    # Machine-readable output for list and search. Content is written exactly as stored, markup included.
+    if output_format == "jsonl":
+        write_jsonl(stream, rows)
+    elif output_format == "json":
+        separator = "["
+        for row in rows:
+            stream.write(separator + "\n" + json.dumps(row_record(row)))
+            separator = ","
+        stream.write("[]\n" if separator == "[" else "\n]\n")
+    elif output_format == "tsv":
+        for row in rows:
+            stream.write("\t".join(tsv_field(value) for value in row_record(row).values()) + "\n")
+    else:
+        for row in rows:
+            record = row_record(row)
+            note_id = f"{record['journal']}:{record['id']}" if "journal" in record else record["id"]
+            stream.write(f"{note_id} {record['timestamp'].replace('T', ' ')} [{record['category']}] "
+                         f"{record['content']}\n")
+
+
+def write_categories(stream, categories, output_format):
+    if output_format == "json":
+        stream.write(json.dumps(list(categories)) + "\n")
+    elif output_format == "jsonl":
+        for category in categories:
+            stream.write(json.dumps({"category": category}) + "\n")
+    elif output_format == "tsv":
+        for category in categories:
+            stream.write(tsv_field(category) + "\n")
+    else:
+        for category in categories:
+            stream.write(category + "\n")
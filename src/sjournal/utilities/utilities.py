@@ -1,12 +1,19 @@
 import os
 import re
+from datetime import datetime
+from functools import lru_cache
 
 
-def get_newest_file(dir):
+def get_newest_file(dir, extensions=None):
+    # extensions: only consider files ending with one of these, e.g. (".db", ".db.gz")
     try:
         db_file_list = os.listdir(dir)
     except FileNotFoundError:
         return None
+    if extensions is not None:
+        db_file_list = [filename for filename in db_file_list if filename.endswith(tuple(extensions))]
+    if not db_file_list:
+        return None
     for i, filename in enumerate(db_file_list):
         db_file_list[i] = os.path.join(dir, filename)
     return max(db_file_list, key=os.path.getctime)
@@ -27,4 +34,146 @@ def range_parser(item_list):
                         new_list.append(int(i))
                 else:
                     new_list.append(item)
-    return new_list
\ No newline at end of file
+    return new_list
+
+
+def fts_query(text):
+    # Translate search text into an FTS5 query. Words are matched as prefixes, "quoted phrases" and
+    # trailing * are passed through. Returns None when the text needs a regular expression instead.
+    terms = []
+    for token in re.findall(r'"[^"]*"\*?|\S+', text):
+        if token.startswith('"') and re.fullmatch(r'"[\w\s]*"\*?', token):
+            if token.strip('"*').strip():
+                terms.append(token)
+        elif re.fullmatch(r"\w+\*?", token):
+            terms.append(f'"{token.rstrip("*")}"*')
+        else:
+            return None
+    return " ".join(terms) or None
+
+
+@lru_cache(maxsize=256)
+def compile_pattern(pattern):
+    # Search patterns are matched case-insensitively. Compiled once per pattern, not once per row.
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def regexp(pattern, value):
+    # SQLite's REGEXP operator: "value REGEXP pattern" calls regexp(pattern, value)
+    if pattern is None or value is None:
+        return False
+    return compile_pattern(pattern).search(value) is not None
+
+
+def apply_style(content, style):
+    # Wrap note content in rich console markup for the given style
+    if style:
+        return f"[{style}]{content}[/]"
+    return content
+
+
+def strip_style(content):
+    # Content without the style apply_style wrapped it in, if it has one. Markup inside the note is kept.
+    match = re.fullmatch(r"\[(?!/)[^\[\]]+\](.*)\[/\]", content, re.DOTALL)
+    if not match:
+        return content
+    depth = 0
+    for tag in re.findall(r"\[/?[^\[\]]*\]", match.group(1)):
+        depth += -1 if tag.startswith("[/") else 1
+        if depth < 0:
+            # "[bold]a[/] and [red]b[/]": the first tag does not wrap the whole note
+            return content
+    return match.group(1) if depth == 0 else content
+
+
+def restyle(content, style):
+    # SQL function restyle(content, style): replace the note's style; an empty style removes it
+    if content is None:
+        return None
+    return apply_style(strip_style(content), style)
+
+
+def parse_timestamp(value):
+    # Convert epoch seconds, ISO-8601 text or the legacy "%m-%d-%y %H:%M:%S" text to epoch seconds
+    if value is None or value == "":
+        return int(datetime.now().timestamp())
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = str(value).strip()
+    if re.fullmatch(r"-?\d+(\.\d*)?", value):
+        return int(float(value))
+    try:
+        return int(datetime.strptime(value, "%m-%d-%y %H:%M:%S").timestamp())
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+
+# Durations for --since/--until relative to now, e.g. "30m", "3h", "7d", "2w"
+DURATION_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_time_filter(value):
+    # Epoch seconds for a --since/--until value: a duration back from now, a year (its first moment), or a date
+    # parse_timestamp reads. Other bare numbers are rejected rather than read as epoch seconds, which would put
+    # "--since 20220320" in 1970; library callers can still pass epoch seconds as an int.
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = str(value).strip()
+    match = re.fullmatch(r"(\d+)\s*([mhdw])", value)
+    if match:
+        return int(datetime.now().timestamp()) - int(match.group(1)) * DURATION_UNITS[match.group(2)]
+    if re.fullmatch(r"\d{4}", value):
+        return int(datetime(int(value), 1, 1).timestamp())
+    if re.fullmatch(r"-?\d+(\.\d*)?", value):
+        raise ValueError(f"{value} is not a date: give a year (2022), a date (2022-03-20) or a span back from now (7d)")
+    return parse_timestamp(value)
+
+
+def id_filter(criteria):
+    # Compile ID criteria ("3", "2-5", "-5" for up to 5, "10-" for 10 and above) into one SQL condition.
+    # The overall lowest/highest ID is added as a range so SQLite can seek on the primary key.
+    if not criteria:
+        raise ValueError("no IDs or ranges given")
+    singles = []
+    clauses = []
+    params = []
+    lowest = []
+    highest = []
+    for item in criteria:
+        if item.isnumeric():
+            singles.append(int(item))
+            continue
+        match = re.fullmatch(r"(\d*)\W(\d*)", item)
+        if not match or not any(match.groups()):
+            raise ValueError(f"invalid ID or range: {item}")
+        minimum, maximum = match.groups()
+        if minimum and maximum:
+            clauses.append("id BETWEEN ? AND ?")
+            params += [int(minimum), int(maximum)]
+        elif maximum:
+            clauses.append("id <= ?")
+            params.append(int(maximum))
+        else:
+            clauses.append("id >= ?")
+            params.append(int(minimum))
+        lowest.append(int(minimum) if minimum else None)
+        highest.append(int(maximum) if maximum else None)
+    if singles:
+        clauses.insert(0, f"id IN ({', '.join('?' * len(singles))})")
+        params = singles + params
+        lowest += singles
+        highest += singles
+
+    if len(clauses) == 1:
+        return f"({clauses[0]})", params
+
+    condition = "(" + " OR ".join(clauses)
+    if None not in lowest:
+        condition += ") AND id >= ?"
+        params.append(min(lowest))
+    else:
+        condition += ")"
+    if None not in highest:
+        condition += " AND id <= ?"
+        params.append(max(highest))
+    return "(" + condition + ")", params
@@ -1,13 +1,22 @@
 import pytest
 import subprocess
 import argparse
+import csv
+import io
 import os
 import random
 import re
 import json
 import shutil
+import socket
+import sqlite3
+import time
 from platform import system
+from datetime import datetime
 from src.sjournal import SJournal
+from src.sjournal.utilities.backups import CATALOG_NAME
+from src.sjournal.utilities.schema import SCHEMA_VERSION
+from src.sjournal.utilities.daemon import forward, stop
 from utils_test import backup_file, delete_file, \
     get_project_root, \
     validate_note, validate_config, \
@@ -23,6 +32,20 @@ n_gen_categories = 3
 n_gen_styles = 5
 
 
+@pytest.fixture(scope="function")
+def run_sjournal(environment):
+    # Run an sjournal command line, check that it succeeded and return its output
+    sjournal_exec = environment[-1]
+
+    def run(command):
+        result = subprocess.run(f"{sjournal_exec} {command}", shell=True, capture_output=True, text=True)
+        logger.debug(result)
+        assert result.returncode == 0
+        return result.stdout
+
+    return run
+
+
 @pytest.fixture(scope="function")
 def clean_journal(environment):
     ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
@@ -53,7 +76,8 @@ def clean_journal(environment):
 
     yield journal
 
-    # delete notebook
+    # delete notebook, closing the connection journal.notes and journal.length leave open
+    journal.close_connection()
     journal_file = os.path.join(SJOURNAL_DIR, "journals", "automated_test.db")
     delete_file(journal_file)
 
@@ -561,4 +585,604 @@ def test_dummy(environment):
     logger.info(f"{HOME_DIR=}")
     logger.info(f"{SJOURNAL_DIR=}")
     logger.info(f"{DEBUG_OUTPUT=}")
-    logger.info(f"{sjournal_exec=}")
\ No newline at end of file
+    logger.info(f"{sjournal_exec=}")
+
+@pytest.mark.parametrize('command, expected_ids', [
+        ('search Note -q 3', [20, 19, 18]),
+        ('search "Note 1" -c "Category 1"', [1, 10, 13, 16, 19]),
+        ('search --regex "Note 1[0-2]$"', [10, 11, 12]),
+        ('search "^Note 2" -q 1', [20]),
+])
+def test_search_options(fixed_notes_journal, environment, command, expected_ids):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    commandline = f"{sjournal_exec} --debug " + command
+    logger.debug(commandline)
+    result = subprocess.run(commandline, shell=True, capture_output=False)
+    assert result.returncode == 0
+
+    with open(DEBUG_OUTPUT, "r") as output_file:
+        full_text = output_file.read()
+    logger.debug(full_text)
+
+    # Every row of the table starts with the note ID
+    found_ids = [int(note_id) for note_id in re.findall(r"^\W+(\d+)\s+│", full_text, re.MULTILINE)]
+    assert sorted(found_ids) == sorted(expected_ids)
+
+
+@pytest.mark.parametrize('file_format, text', [
+        ('jsonl', '{"content": "Imported 0", "category": "Old"}\n{"content": "Imported 1", "timestamp": "03-20-22 15:30:55"}\n'
+                  '{"content": "Imported 2", "category": "Old", "timestamp": 1647790255}\n'),
+        ('csv', 'category,content,timestamp\nOld,Imported 0,\n,Imported 1,03-20-22 15:30:55\nOld,"Imported 2",1647790255\n'),
+        ('lines', 'Imported 0\nImported 1\n\nImported 2\n'),
+])
+def test_import(fixed_notes_journal, environment, tmp_path, file_format, text):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    journal = fixed_notes_journal
+    import_file = tmp_path / f"notes.{file_format}"
+    import_file.write_text(text)
+
+    # Files are imported by extension, plain lines are piped through stdin
+    if file_format == "lines":
+        commandline = f'{sjournal_exec} import -c Imported -b 2 < "{import_file}"'
+    else:
+        commandline = f'{sjournal_exec} import -c Imported -b 2 "{import_file}"'
+    result = subprocess.run(commandline, shell=True, capture_output=True)
+    logger.debug(result)
+    assert result.returncode == 0
+    assert b"IMPORTED 3 NOTES" in result.stdout
+
+    notes = journal.notes
+    assert len(notes) == n_gen_notes + 3
+    for i, note in enumerate(notes[n_gen_notes:]):
+        assert note.id == n_gen_notes + i
+        assert note.content == f"Imported {i}"
+    if file_format != "lines":
+        assert [note.category for note in notes[n_gen_notes:]] == ["Old", "Imported", "Old"]
+        assert notes[-1].timestamp == notes[-2].timestamp == "03-20-22 15:30:55"
+
+    # Imported notes are searchable
+    commandline = f"{sjournal_exec} --debug search imported"
+    result = subprocess.run(commandline, shell=True, capture_output=False)
+    assert result.returncode == 0
+    with open(DEBUG_OUTPUT, "r") as output_file:
+        assert len(re.findall(r"Imported \d", output_file.read())) == 3
+
+
+@pytest.mark.parametrize('bad_line, error', [
+        ('{not json}', b"line 3"),
+        ('5', b"line 3: expected an object or a string"),
+        ('null', b"line 3: expected an object or a string"),
+        ('{"category": "Old"}', b"line 3: record has no 'content'"),
+        ('{"content": null}', b"no content"),
+        ('{"content": ""}', b"no content"),
+])
+def test_import_is_atomic(fixed_notes_journal, environment, tmp_path, bad_line, error):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    journal = fixed_notes_journal
+    import_file = tmp_path / "broken.jsonl"
+    import_file.write_text(f'{{"content": "fine"}}\n{{"content": "fine too"}}\n{bad_line}\n')
+
+    commandline = f'{sjournal_exec} import -b 1 "{import_file}"'
+    result = subprocess.run(commandline, shell=True, capture_output=True)
+    assert result.returncode == 0
+    assert b"IMPORT FAILED" in result.stdout and error in result.stdout
+    assert b"Traceback" not in result.stderr
+    assert journal.length == n_gen_notes
+
+
+@pytest.mark.parametrize('options, expected_ids', [
+        ('', list(range(n_gen_notes))),
+        ('-c "Category 1"', list(range(1, n_gen_notes, 3))),
+        ('--ids 2 5-7 19-', [2, 5, 6, 7, 19, 20]),
+        ('-c "Category 2" --ids -10', [2, 5, 8]),
+        ('--since 2000-01-01 --until 2000-01-02', []),
+])
+@pytest.mark.parametrize('file_format', ['jsonl', 'csv', 'markdown'])
+def test_export(fixed_notes_journal, environment, tmp_path, file_format, options, expected_ids):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    journal = fixed_notes_journal
+    notes = {note.id: note for note in journal.notes}
+    export_file = tmp_path / f"export.{file_format}"
+
+    commandline = f'{sjournal_exec} export -f {file_format} -b 4 {options} -o "{export_file}"'
+    logger.debug(commandline)
+    result = subprocess.run(commandline, shell=True, capture_output=True)
+    logger.debug(result)
+    assert result.returncode == 0
+
+    text = export_file.read_text()
+    if file_format == "jsonl":
+        records = [json.loads(line) for line in text.splitlines()]
+    elif file_format == "csv":
+        records = list(csv.DictReader(io.StringIO(text)))
+    else:
+        rows = [line for line in text.splitlines() if line.startswith("| ") and not line.startswith("| ID")]
+        records = [dict(zip(["id", "timestamp", "category", "content"], row.strip("| ").split(" | "))) for row in rows]
+
+    assert [int(record["id"]) for record in records] == expected_ids
+    for record in records:
+        note = notes[int(record["id"])]
+        assert record["category"] == note.category
+        assert record["content"] == note.content
+
+
+def test_export_import_round_trip(random_journal, environment):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    journal = random_journal
+    original_notes = journal.notes
+
+    # Pipe the whole journal back into itself: every note is duplicated with the same data
+    commandline = f"{sjournal_exec} export | {sjournal_exec} import -f jsonl"
+    result = subprocess.run(commandline, shell=True, capture_output=True)
+    logger.debug(result)
+    assert result.returncode == 0
+
+    notes = journal.notes
+    assert len(notes) == 2 * len(original_notes)
+    for original, copy in zip(original_notes, notes[len(original_notes):]):
+        assert (copy.category, copy.content, copy.timestamp) == (original.category, original.content, original.timestamp)
+
+
+@pytest.mark.parametrize('criteria, deleted_ids', [
+        ('3 5 7', [3, 5, 7]),
+        ('2-4 10', [2, 3, 4, 10]),
+        ('-3', [0, 1, 2, 3]),
+        ('17-', [17, 18, 19, 20]),
+        ('0-1000000', list(range(n_gen_notes))),
+        ('50-60', []),
+])
+@pytest.mark.parametrize('verbose', [False, True])
+def test_delete_ranges(fixed_notes_journal, environment, criteria, deleted_ids, verbose):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    journal = fixed_notes_journal
+    commandline = f"{sjournal_exec} delete {criteria}" + (" --verbose" if verbose else "")
+    result = subprocess.run(commandline, shell=True, capture_output=True, text=True)
+    logger.debug(result)
+    assert result.returncode == 0
+
+    # A summary line is always printed, per-note lines only with --verbose
+    assert f"DELETED {len(deleted_ids)} NOTE" in result.stdout
+    printed_ids = [int(note_id) for note_id in re.findall(r"DELETED NOTE #(\d+)", result.stdout)]
+    assert printed_ids == (deleted_ids if verbose else [])
+
+    remaining_ids = [note.id for note in journal.notes]
+    assert remaining_ids == [i for i in range(n_gen_notes) if i not in deleted_ids]
+
+
+@pytest.mark.parametrize('options, expected', [
+        ('--ids 2-4 -c Moved', {2: ("Moved", "Note 2"), 3: ("Moved", "Note 3"), 4: ("Moved", "Note 4")}),
+        ('--ids 1 5 -s "bold red"', {1: (None, "[bold red]Note 1[/]"), 5: (None, "[bold red]Note 5[/]")}),
+        ('--ids 0 -c Done -s ""', {0: ("Done", "Note 0")}),
+        ('--since 2000-01-01 -c All', {i: ("All", f"Note {i}") for i in range(n_gen_notes)}),
+        ('--ids 50-60 -c Nowhere', {}),
+])
+def test_update_notes(fixed_notes_journal, environment, options, expected):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    journal = fixed_notes_journal
+    original_notes = journal.notes
+    result = subprocess.run(f"{sjournal_exec} update {options}", shell=True, capture_output=True, text=True)
+    logger.debug(result)
+    assert result.returncode == 0
+    assert f"UPDATED {len(expected)} NOTE" in result.stdout
+
+    # Selected notes change in place; every other note, and every ID and time, stays as it was
+    for original, note in zip(original_notes, journal.notes):
+        assert (note.id, note.timestamp) == (original.id, original.timestamp)
+        category, content = expected.get(note.id, (original.category, original.content))
+        assert (note.category, note.content) == (category or original.category, content)
+
+
+def test_backup_with_concurrent_writer(random_journal, environment):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    journal = random_journal
+
+    # Copy one page per step so the backup is spread out while another process keeps adding notes
+    config_file_path = os.path.join(SJOURNAL_DIR, "sjournal_config.json")
+    with open(config_file_path, "r") as config_file:
+        config = json.load(config_file)
+    config.update({"backup_pages_per_step": 1, "backup_step_sleep": 0.01})
+    with open(config_file_path, "w") as config_file:
+        config_file.write(json.dumps(config))
+
+    writer = subprocess.Popen(f"for i in 1 2 3 4 5 6 7 8 9 10; do {sjournal_exec} add concurrent note $i; done",
+                              shell=True, executable="/bin/bash" if system() != "Windows" else None)
+    result = subprocess.run(f"{sjournal_exec} backup -f concurrent_backup", shell=True, capture_output=True)
+    writer.wait()
+    assert result.returncode == 0
+    assert writer.returncode == 0
+
+    # The backup is a valid database holding a consistent snapshot: IDs are contiguous from 0
+    backup_file_path = os.path.join(SJOURNAL_DIR, "journals", "backups", "automated_test", "concurrent_backup.db")
+    connection = sqlite3.connect(backup_file_path)
+    assert connection.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    ids = [row[0] for row in connection.execute("SELECT id FROM notes ORDER BY id")]
+    connection.close()
+    assert n_gen_notes <= len(ids) <= n_gen_notes + 10
+    assert ids == list(range(len(ids)))
+    assert journal.length == n_gen_notes + 10
+
+
+@pytest.mark.parametrize('start', ['existing', 'new', 'legacy'])
+def test_concurrent_add_and_list(clean_journal, environment, start):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    journal = clean_journal
+    n_writers, n_adds = 6, 8
+
+    # The first commands to open a journal that does not exist yet, or predates the current schema, race to
+    # create or migrate it
+    if start != 'existing':
+        journal.close_connection()
+        delete_file(journal.db_file)
+    if start == 'legacy':
+        connection = sqlite3.connect(journal.db_file)
+        connection.execute("CREATE TABLE notes(id integer PRIMARY KEY, timestamp text, category text, content text)")
+        connection.commit()
+        connection.close()
+
+    # Several shells add notes while others keep listing the journal
+    shell = "/bin/bash" if system() != "Windows" else None
+    writers = [subprocess.Popen(f"for i in $(seq {n_adds}); do {sjournal_exec} add writer {w} note $i || exit 1; done",
+                                shell=True, executable=shell, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+               for w in range(n_writers)]
+    readers = [subprocess.Popen(f"for i in $(seq {n_adds}); do {sjournal_exec} list 5 || exit 1; done",
+                                shell=True, executable=shell, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+               for _ in range(2)]
+    for process in writers + readers:
+        _, errors = process.communicate()
+        assert process.returncode == 0, errors.decode()
+        assert b"locked" not in errors
+
+    # No write was lost and every note got its own ID
+    notes = journal.notes
+    assert len(notes) == n_writers * n_adds
+    assert sorted(note.id for note in notes) == list(range(n_writers * n_adds))
+    assert sorted(note.content for note in notes) == \
+        sorted(f"writer {w} note {i}" for w in range(n_writers) for i in range(1, n_adds + 1))
+
+    connection = sqlite3.connect(journal.db_file)
+    assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    connection.close()
+
+
+def test_incremental_backup_and_restore(fixed_notes_journal, environment, run_sjournal):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    journal = fixed_notes_journal
+    backup_dir = os.path.join(SJOURNAL_DIR, "journals", "backups", "automated_test")
+
+    # Full backup, then two incrementals with changes in between
+    run_sjournal("backup -f base")
+    states = {"base": journal.notes}
+    run_sjournal("add -c Later one more note")
+    run_sjournal("backup -i -f step1")
+    states["step1"] = journal.notes
+    run_sjournal("delete 0-4")
+    run_sjournal('add -c Later "and another"')
+    output = run_sjournal("backup -i -f step2")
+    states["step2"] = journal.notes
+    assert "STORED" in output
+
+    # Incrementals only hold the changed pages and are recorded in the catalog
+    base_size = os.path.getsize(os.path.join(backup_dir, "base.db"))
+    assert os.path.getsize(os.path.join(backup_dir, "step1.sjinc")) < base_size
+    listing = run_sjournal("restore --list")
+    assert re.search(r"full\s+base\.db.*incremental\s+step1\.sjinc.*incremental\s+step2\.sjinc", listing, re.DOTALL)
+
+    # Restoring the latest backup replays the whole chain
+    run_sjournal("erase")
+    assert journal.length == 0
+    run_sjournal("restore")
+    assert journal.notes == states["step2"]
+
+    # Any backup in the chain can be restored by name
+    for name in ["step1", "base", "step2"]:
+        run_sjournal("erase")
+        run_sjournal(f"restore -f {name}")
+        assert journal.notes == states[name]
+
+    # Point in time restores pick the newest backup taken before the given time
+    run_sjournal("erase")
+    run_sjournal(f"restore --at {datetime.now().isoformat()}")
+    assert journal.notes == states["step2"]
+    assert "no backup from before" in run_sjournal("restore --at 2000-01-01")
+
+
+@pytest.mark.parametrize('compression, extension', [('gzip', '.gz'), ('lzma', '.xz'), ('zstd', '.zst')])
+def test_compressed_backup_and_restore(fixed_notes_journal, environment, run_sjournal, compression, extension):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+
+    journal = fixed_notes_journal
+    backup_dir = os.path.join(SJOURNAL_DIR, "journals", "backups", "automated_test")
+
+    # Full and incremental backups are written compressed, without leaving an uncompressed copy behind
+    run_sjournal(f"backup -f base --compress {compression}")
+    states = {"base": journal.notes}
+    run_sjournal("add -c Later one more note")
+    run_sjournal(f"backup -i -f step1 --compress {compression}")
+    states["step1"] = journal.notes
+    assert sorted(os.listdir(backup_dir)) == sorted([CATALOG_NAME, f"base.db{extension}", f"step1.sjinc{extension}"])
+    assert os.path.getsize(os.path.join(backup_dir, f"base.db{extension}")) < os.path.getsize(journal.db_file)
+
+    for name in ["base", "step1"]:
+        run_sjournal("erase")
+        run_sjournal(f"restore -f {name}")
+        assert journal.notes == states[name]
+
+
+def test_backup_retention(fixed_notes_journal, environment, run_sjournal):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    journal = fixed_notes_journal
+    backup_dir = os.path.join(SJOURNAL_DIR, "journals", "backups", "automated_test")
+
+    run_sjournal("backup -f first")
+    run_sjournal("add one more note")
+    run_sjournal("backup -i -f first_step")
+
+    # Keeping one hourly backup keeps only the newest backup and the chain it depends on
+    config_filename = os.path.join(SJOURNAL_DIR, "sjournal_config.json")
+    with open(config_filename) as config_file:
+        config = json.load(config_file)
+    config["backup_retention"] = {"hourly": 1}
+    with open(config_filename, "w") as config_file:
+        config_file.write(json.dumps(config))
+
+    run_sjournal("add another note")
+    output = run_sjournal("backup -i -f second_step")
+    assert "PRUNED" not in output
+    assert sorted(os.listdir(backup_dir)) == sorted([CATALOG_NAME, "first.db", "first_step.sjinc", "second_step.sjinc"])
+
+    output = run_sjournal("backup -f second -z gzip")
+    assert "PRUNED 3 BACKUPS" in output
+    assert sorted(os.listdir(backup_dir)) == sorted([CATALOG_NAME, "second.db.gz"])
+    assert "second.db.gz" in run_sjournal("restore --list")
+
+    notes = journal.notes
+    run_sjournal("erase")
+    run_sjournal("restore")
+    assert journal.notes == notes
+
+    # An unknown period or a bad count is reported as a config error, and nothing is pruned
+    for retention in [{"yearly": 2}, {"daily": -1}, {"daily": "7"}]:
+        config["backup_retention"] = retention
+        with open(config_filename, "w") as config_file:
+            config_file.write(json.dumps(config))
+        result = subprocess.run(f"{sjournal_exec} backup", shell=True, capture_output=True, text=True)
+        assert result.returncode == 1
+        assert "Invalid backup_retention" in result.stdout and "Traceback" not in result.stderr
+        assert "second.db.gz" in os.listdir(backup_dir)
+
+
+def test_daemon(fixed_notes_journal, environment, tmp_path):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+    if not hasattr(socket, "AF_UNIX"):
+        pytest.skip("Unix domain sockets are not available")
+
+    journal = fixed_notes_journal
+    path = str(tmp_path / "daemon.sock")
+    daemon = subprocess.Popen(f"{sjournal_exec} daemon --socket {path}", shell=True, stdout=subprocess.PIPE)
+    try:
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.05)
+
+        def run(*argv):
+            output = io.StringIO()
+            return forward(path, list(argv), output), output.getvalue()
+
+        # Commands run in the daemon and their output comes back to the client
+        assert run("add", "-c", "Daemon", "added through the daemon") == (0, "")
+        assert journal.length == n_gen_notes + 1
+        status, output = run("list", "3")
+        assert status == 0
+        assert "added through the daemon" in output and "Note 20" in output
+        status, output = run("search", "through")
+        assert "added through the daemon" in output
+        status, output = run("delete", str(n_gen_notes))
+        assert output.strip() == "DELETED 1 NOTE"
+        assert journal.length == n_gen_notes
+
+        # Commands that need the client's terminal, files or config are handed back to it
+        assert run("edit", "1") == (None, "")
+        assert run("add") == (None, "")
+        assert run("load", "other") == (None, "")
+        assert run("list", "--no-such-option") == (None, "")
+
+        assert stop(path)
+        daemon.wait(timeout=10)
+    finally:
+        if daemon.poll() is None:
+            daemon.kill()
+
+    # Without a daemon the client runs commands itself
+    assert not os.path.exists(path)
+    assert forward(path, ["list"]) is None
+
+
+def test_list_long_results(clean_journal, environment):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    n_notes = 250
+    lines = "".join(f"long note {i}\n" for i in range(n_notes))
+    result = subprocess.run(f"{sjournal_exec} import -f lines", shell=True, input=lines, capture_output=True, text=True)
+    assert result.returncode == 0
+
+    # Long results are rendered in chunks: one title and header, then every note in order
+    for command, expected_ids in [("list -a", range(n_notes - 1, -1, -1)),
+                                  ("list -a -r", range(n_notes)),
+                                  ("search long", range(n_notes - 1, -1, -1)),
+                                  ("list 150 -r", range(n_notes - 150, n_notes))]:
+        result = subprocess.run(f"{sjournal_exec} {command}", shell=True, capture_output=True, text=True)
+        assert result.returncode == 0
+        assert result.stdout.count("Timestamp") == 1, command
+        ids = [int(line.split()[0]) for line in result.stdout.splitlines() if re.match(r"\s*\d+\s", line)]
+        assert ids == list(expected_ids), command
+
+
+@pytest.mark.parametrize('command', ['list -a', 'search Note', 'categories'])
+@pytest.mark.parametrize('output_format', ['tsv', 'json', 'jsonl', 'plain'])
+def test_output_formats(fixed_notes_journal, environment, command, output_format):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    journal = fixed_notes_journal
+    # Markup and tabs in note content are written untouched
+    subprocess.run(f'{sjournal_exec} add -c Markup -s "bold red" "tab\there"', shell=True, check=True)
+    notes = journal.notes[::-1]
+
+    result = subprocess.run(f"{sjournal_exec} {command} --format {output_format}", shell=True,
+                            capture_output=True, text=True, encoding="utf-8")
+    assert result.returncode == 0
+    output = result.stdout
+
+    if command == "categories":
+        expected = sorted(set(note.category for note in notes))
+        if output_format == "json":
+            assert json.loads(output) == expected
+        elif output_format == "jsonl":
+            assert [json.loads(line)["category"] for line in output.splitlines()] == expected
+        else:
+            assert output.splitlines() == expected
+        return
+
+    if command.startswith("search"):
+        notes = [note for note in notes if "Note" in note.content]
+    if output_format == "json":
+        records = json.loads(output)
+    elif output_format == "jsonl":
+        records = [json.loads(line) for line in output.splitlines()]
+    elif output_format == "tsv":
+        records = [dict(zip(["id", "timestamp", "category", "content"], line.split("\t")))
+                   for line in output.splitlines()]
+        for record in records:
+            record["id"] = int(record["id"])
+            record["content"] = record["content"].replace("\\t", "\t")
+    else:
+        records = [dict(zip(["id", "content"], re.match(r"(\d+) \S+ \S+ \[[^]]*\] (.*)", line).groups()))
+                   for line in output.splitlines()]
+        for record in records:
+            record["id"] = int(record["id"])
+
+    assert [record["id"] for record in records] == [note.id for note in notes]
+    assert [record["content"] for record in records] == [note.content for note in notes]
+    assert "┃" not in output
+
+
+def test_list_pages(fixed_notes_journal, environment):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    journal = fixed_notes_journal
+    all_ids = [note.id for note in journal.notes][::-1]
+
+    def ids(command):
+        result = subprocess.run(f"{sjournal_exec} {command} --format tsv", shell=True, capture_output=True, text=True)
+        assert result.returncode == 0
+        return [int(line.split("\t")[0]) for line in result.stdout.splitlines()]
+
+    # Walking back with --before and numbered pages visit the same notes, newest first
+    page_size = 4
+    keyset_pages = []
+    before = ""
+    while True:
+        page = ids(f"list --page-size {page_size} {before}")
+        if not page:
+            break
+        keyset_pages.append(page)
+        before = f"--before {page[-1]}"
+    numbered_pages = [ids(f"list --page {n} --page-size {page_size}") for n in range(1, len(keyset_pages) + 1)]
+    assert keyset_pages == numbered_pages
+    assert sum(keyset_pages, []) == all_ids
+    assert all(len(page) == page_size for page in keyset_pages[:-1])
+
+    # --after walks forward; pages are still shown newest first
+    assert ids("list 3 --after 5") == [8, 7, 6]
+    assert ids("list 3 --after 5 -r") == [6, 7, 8]
+    assert ids("list --after 5 -c 'Category 0' --page-size 2") == [9, 6]
+    assert ids("search Note --before 10 -q 3") == [9, 8, 7]
+    assert ids("search Note --after 10 -q 3") == [13, 12, 11]
+    assert ids("search Note --page 2 -q 5") == ids("search Note -q 10")[5:]
+
+    # The table output says how to get the next page
+    result = subprocess.run(f"{sjournal_exec} list --page-size 4 --before 10", shell=True, capture_output=True, text=True)
+    assert "repeat with --before 6" in result.stdout
+    result = subprocess.run(f"{sjournal_exec} list --page 2 --page-size 4", shell=True, capture_output=True, text=True)
+    assert "repeat with --page 3" in result.stdout
+    result = subprocess.run(f"{sjournal_exec} list --before 2", shell=True, capture_output=True, text=True)
+    assert "repeat with" not in result.stdout
+
+
+def test_search_all_journals(fixed_notes_journal, environment):
+    ROOT_DIR, HOME_DIR, SJOURNAL_DIR, DEBUG_OUTPUT, sjournal_exec = environment
+
+    # A second journal whose notes interleave in time with the first one's
+    journal = fixed_notes_journal
+    journal.args = argparse.Namespace(command="add", category="Shared", content=["federated newest"], style=None,
+                                      debug=False)
+    journal.run()
+    other_file = os.path.join(SJOURNAL_DIR, "journals", "automated_test_other.db")
+    # Files that are not current journals are skipped and left untouched
+    foreign_file = os.path.join(SJOURNAL_DIR, "journals", "automated_test_foreign.db")
+    legacy_file = os.path.join(SJOURNAL_DIR, "journals", "automated_test_legacy.db")
+    connection = sqlite3.connect(foreign_file)
+    connection.execute("CREATE TABLE things(name text)")
+    connection.commit()
+    connection.close()
+    connection = sqlite3.connect(legacy_file)
+    connection.execute("CREATE TABLE notes(id integer PRIMARY KEY, timestamp text, category text, content text)")
+    connection.execute("INSERT INTO notes VALUES (0, '03-20-22 15:30:55', 'General', 'federated legacy')")
+    connection.commit()
+    connection.close()
+    untouched = {path: open(path, "rb").read() for path in [foreign_file, legacy_file]}
+    now = int(time.time())
+    try:
+        with SJournal.open("automated_test_other") as other:
+            other.add_many([{"content": "federated older", "timestamp": now - 3600},
+                            {"content": "federated oldest", "timestamp": now - 7200},
+                            {"content": "unrelated", "timestamp": now}])
+
+        result = subprocess.run(f"{sjournal_exec} search federated --all-journals --format jsonl", shell=True,
+                                capture_output=True, text=True)
+        assert result.returncode == 0
+        # Skipped journals are always reported, on stderr so the records stay parseable
+        assert re.search(r"Skipped \d+ journals \(.*automated_test_foreign.*automated_test_legacy.*\); run `sj load",
+                         result.stderr)
+        records = [json.loads(line) for line in result.stdout.splitlines()]
+        records = [record for record in records if record["journal"].startswith("automated_test")]
+        assert [(record["journal"], record["id"], record["content"]) for record in records] == [
+            ("automated_test", n_gen_notes, "federated newest"),
+            ("automated_test_other", 0, "federated older"),
+            ("automated_test_other", 1, "federated oldest"),
+        ]
+
+        # The table names the journal with each ID; per-journal timings go to the debug output
+        result = subprocess.run(f"{sjournal_exec} --debug search federated --all-journals -q 2", shell=True,
+                                capture_output=True, text=True)
+        assert result.returncode == 0
+        with open(DEBUG_OUTPUT, "r") as output_file:
+            full_text = output_file.read()
+        assert re.search(r"SEARCHED automated_test_other: 2 MATCHES IN [\d.]+ MS", full_text)
+        assert f"automated_test:{n_gen_notes}" in full_text and "automated_test_other:0" in full_text
+        assert "federated oldest" not in full_text
+        assert re.search(r"SKIPPED automated_test_foreign: schema version 0", full_text)
+        assert re.search(r"SKIPPED automated_test_legacy: schema version 0", full_text)
+        assert re.search(r"Skipped \d+ journals", full_text)
+        for path, content in untouched.items():
+            assert open(path, "rb").read() == content
+            assert not os.path.exists(path + "-wal")
+    finally:
+        for path in [other_file, foreign_file, legacy_file]:
+            for suffix in ["", "-wal", "-shm"]:
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
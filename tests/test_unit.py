@@ -1,8 +1,531 @@
 import pytest
-from src.sjournal import SJournal
+import argparse
+import os
+import io
+import json
+import re
+import shlex
+import subprocess
+import sqlite3
+import sys
+import time
+from src.sjournal import SJournal, Note, parse_args
+from src.sjournal.utilities.schema import migrate, SCHEMA_VERSION
+from src.sjournal.utilities.config import load_config, save_config
+from src.sjournal.utilities.utilities import compile_pattern, regexp, parse_time_filter, restyle, id_filter
+from utils_test import get_project_root
 
 # Unit tests for the SJournal, Note, Utility, and Publish methods
 
 
 def test_publish():
     pass
+
+
+@pytest.mark.parametrize('argv', [
+        ['add', 'hello'],
+        ['list', '--format', 'tsv'],
+        ['search', 'hello', '--format', 'jsonl'],
+        ['categories', '--format', 'plain'],
+])
+def test_add_skips_heavy_imports(tmp_path, argv):
+    # "sj add" runs from shell hooks and --format output feeds scripts, so neither may import the GUI,
+    # clipboard, or rendering libraries, or the thread pool, subprocess and socket support only some commands use
+    code = "\n".join([
+        "import sys",
+        "from src.sjournal.sjournal import main_headless",
+        f"sys.argv = ['sj'] + {argv!r}",
+        "main_headless()",
+        "heavy = ('PySimpleGUI', 'pyperclip', 'rich', 'concurrent.futures', 'subprocess', 'socket')",
+        "print([m for m in heavy if m in sys.modules], file=sys.stderr)",
+    ])
+    # Pre-create the config so the first-run message (printed through rich) is not triggered
+    os.makedirs(tmp_path / "sjournal")
+    config = {"journal_dir": str(tmp_path / "sjournal" / "journals"), "journal_name": "notes"}
+    with open(tmp_path / "sjournal" / "sjournal_config.json", "w") as config_file:
+        config_file.write(json.dumps(config))
+
+    env = dict(os.environ, HOME=str(tmp_path), USERPROFILE=str(tmp_path))
+    result = subprocess.run([sys.executable, "-c", code], cwd=get_project_root(), env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stderr.strip() == "[]", f"heavy modules imported: {result.stderr}"
+
+
+def test_client_imports_only_daemon_protocol(tmp_path):
+    # "sjc" forwards to the daemon without loading the rest of sjournal, and runs the command itself when no
+    # daemon is listening
+    code = "\n".join([
+        "import sys",
+        "from src.sjournal.client import main_client",
+        "print(sorted(m for m in sys.modules if m.startswith('src.sjournal.')), file=sys.stderr)",
+        "sys.argv = ['sjc', 'add', 'no daemon here']",
+        "main_client()",
+    ])
+    os.makedirs(tmp_path / "sjournal")
+    config = {"journal_dir": str(tmp_path / "sjournal" / "journals"), "journal_name": "notes"}
+    with open(tmp_path / "sjournal" / "sjournal_config.json", "w") as config_file:
+        config_file.write(json.dumps(config))
+
+    env = dict(os.environ, HOME=str(tmp_path), USERPROFILE=str(tmp_path))
+    result = subprocess.run([sys.executable, "-c", code], cwd=get_project_root(), env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stderr.splitlines()[0] == str(["src.sjournal.client", "src.sjournal.utilities",
+                                                  "src.sjournal.utilities.daemon", "src.sjournal.utilities.version"])
+    connection = sqlite3.connect(tmp_path / "sjournal" / "journals" / "notes.db")
+    assert connection.execute("SELECT content FROM notes").fetchall() == [("no daemon here",)]
+    connection.close()
+
+
+def test_migrate_legacy_timestamps(tmp_path):
+    # Journals created before timestamps were stored as epoch seconds are converted on open
+    connection = sqlite3.connect(tmp_path / "legacy.db")
+    connection.execute("CREATE TABLE notes(id integer PRIMARY KEY, timestamp text, category text, content text)")
+    connection.execute("INSERT INTO notes VALUES (0, '12-31-21 23:59:58', 'General', 'old year')")
+    connection.execute("INSERT INTO notes VALUES (1, '01-01-22 00:00:01', 'General', 'new year')")
+    connection.commit()
+
+    migrate(connection)
+
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    rows = connection.execute("SELECT * FROM note_rows ORDER BY timestamp").fetchall()
+    assert [row[0] for row in rows] == [0, 1]
+    assert [Note.from_row(row).timestamp for row in rows] == ['12-31-21 23:59:58', '01-01-22 00:00:01']
+    assert [row[2] for row in rows] == ["General", "General"]
+
+    # The full-text index survives the table rebuilds and follows new inserts
+    connection.execute("INSERT INTO categories (name) VALUES ('Other')")
+    connection.execute("INSERT INTO notes VALUES (2, 0, (SELECT id FROM categories WHERE name = 'Other'), 'brand new')")
+    matches = connection.execute("SELECT rowid FROM notes_fts WHERE notes_fts MATCH 'new' ORDER BY rowid").fetchall()
+    assert matches == [(1,), (2,)]
+
+    # Category names are stored once, with counts kept by triggers
+    counts = connection.execute("SELECT name, note_count FROM categories ORDER BY name").fetchall()
+    assert counts == [("General", 2), ("Other", 1)]
+    connection.execute("UPDATE notes SET category_id = (SELECT id FROM categories WHERE name = 'Other') WHERE id = 0")
+    connection.execute("DELETE FROM notes WHERE id = 2")
+    counts = connection.execute("SELECT name, note_count FROM categories ORDER BY name").fetchall()
+    assert counts == [("General", 1), ("Other", 1)]
+
+
+# Statements that have to visit every row by design, whatever indexes exist
+FULL_SCAN_COMMANDS = ["list -a", 'search --regex "meet.*g"', "erase", "export"]
+
+
+def uses_full_scan(connection, statement):
+    plan = [row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {statement}")]
+    for detail in plan:
+        if re.match(r"SCAN notes\b(?! USING)", detail):
+            # Walking the rowid b-tree in id order is fine when nothing is filtered and a LIMIT stops it
+            if not re.search(r"FROM note(s|_rows) ORDER BY id \w+ LIMIT", statement):
+                return True
+    return False
+
+
+@pytest.mark.parametrize('command', [
+        'add -c Work "planning meeting"',
+        'list',
+        'list 10',
+        'list -c Work',
+        'list 3 -c Work -r',
+        'list -a',
+        'list --ids 3 5-8 15-',
+        'list --since 2000-01-01 --until 2000-02-01',
+        'list --since 7d',
+        'list --before 10',
+        'list --after 3 -c Work',
+        'list --page 3 --page-size 4',
+        'list --page 2 -c Work',
+        'search meeting',
+        'search meeting -c Work',
+        'search meeting --before 10 -q 3',
+        'search --regex "meet.*g"',
+        'search --regex "meet.*g" -c Work',
+        'search meeting --since 3h',
+        'search --regex "meet.*g" --since 2000-01-01 --until 2000-01-02',
+        'categories',
+        'categories -s wor',
+        'edit 1',
+        'import -f lines',
+        'export',
+        'export -c Work --ids 3-9',
+        'export --since 2000-01-01',
+        'delete 1 2 4-5',
+        'delete --since 2w --until 1w',
+        'update --ids 3-9 -c Done -s bold',
+        'update --since 1h -c Today',
+        'erase',
+])
+def test_commands_use_indexes(tmp_path, monkeypatch, command):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    monkeypatch.setattr("rich.prompt.Prompt.ask", lambda *args, **kwargs: "edited")
+    monkeypatch.setattr("pyperclip.copy", lambda text: None)
+    monkeypatch.setattr(sys, "stdin", io.StringIO("imported meeting\n"))
+
+    journal = SJournal(argparse.Namespace(command="load", journal_name="plans", debug=False))
+    journal.run()
+    for i in range(20):
+        journal.args = argparse.Namespace(command="add", category=["Work", "Home"][i % 2], content=[f"meeting {i}"],
+                                          style=None, debug=False)
+        journal.run()
+
+    # Record every statement the command sends to SQLite
+    statements = []
+    create_connection = journal.create_connection
+
+    def traced_connection():
+        create_connection()
+        journal.connection.set_trace_callback(statements.append)
+
+    monkeypatch.setattr(journal, "create_connection", traced_connection)
+    monkeypatch.setattr(sys, "argv", ["sj"] + shlex.split(command))
+    journal.args = parse_args()
+    journal.run()
+
+    queries = [s for s in statements if re.match(r"\s*(SELECT|INSERT|UPDATE|DELETE)", s, re.IGNORECASE)]
+    assert queries, f"no queries recorded for {command}"
+
+    connection = sqlite3.connect(journal.db_file)
+    connection.create_function("REGEXP", 2, regexp)
+    connection.create_function("restyle", 2, restyle)
+    scans = [query for query in queries if uses_full_scan(connection, query)]
+    connection.close()
+    if command in FULL_SCAN_COMMANDS:
+        return
+    assert not scans, f"'{command}' scans the notes table: {scans}"
+
+
+def test_add_allocates_id_in_insert(tmp_path, monkeypatch):
+    # The next ID is computed by the INSERT itself: one statement per note, no separate lookup to race on
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    journal = SJournal(argparse.Namespace(command="load", journal_name="ids", debug=False))
+    journal.run()
+
+    statements = []
+    create_connection = journal.create_connection
+
+    def traced_connection():
+        create_connection()
+        journal.connection.set_trace_callback(statements.append)
+
+    monkeypatch.setattr(journal, "create_connection", traced_connection)
+    for i in range(3):
+        statements.clear()
+        journal.args = argparse.Namespace(command="add", category="General", content=[f"note {i}"], style=None,
+                                          debug=False)
+        journal.run()
+        # Statements run by triggers are reported again under the statement that fired them
+        notes_statements = set(s for s in statements if re.search(r"\bnotes\b", s) and "sqlite_master" not in s)
+        assert len(notes_statements) == 1 and notes_statements.pop().startswith("INSERT"), notes_statements
+
+    assert [note.id for note in journal.notes] == [0, 1, 2]
+
+
+def test_list_pager(tmp_path, monkeypatch):
+    # --pager streams the rendered notes into $PAGER when output goes to a terminal
+    from rich.console import Console
+
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    paged_file = tmp_path / "paged.txt"
+    monkeypatch.setenv("PAGER", f"cat > {shlex.quote(str(paged_file))}")
+
+    journal = SJournal(argparse.Namespace(command="load", journal_name="paged", debug=False))
+    journal.run()
+    for i in range(3):
+        journal.args = argparse.Namespace(command="add", category="General", content=[f"paged note {i}"], style=None,
+                                          debug=False)
+        journal.run()
+
+    terminal = io.StringIO()
+    journal.console = Console(file=terminal, force_terminal=True, width=80)
+    journal.args = parse_args(["list", "--pager"])
+    journal.run()
+
+    assert terminal.getvalue() == ""
+    assert all(f"paged note {i}" in paged_file.read_text() for i in range(3))
+
+
+def test_config_cache_and_atomic_save(tmp_path, monkeypatch):
+    path = str(tmp_path / "sjournal_config.json")
+    assert load_config(path) is None
+
+    # Saving writes through a temporary file and only when something changed
+    assert save_config(path, {"journal_name": "aaaa"})
+    assert not save_config(path, {"journal_name": "aaaa"})
+    assert os.listdir(tmp_path) == ["sjournal_config.json"]
+
+    # Reads are served from the cache until the file's mtime or size changes
+    stat = os.stat(path)
+    with open(path, "w") as config_file:
+        config_file.write(json.dumps({"journal_name": "bbbb"}))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert load_config(path) == {"journal_name": "aaaa"}
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert load_config(path) == {"journal_name": "bbbb"}
+
+    # Callers get a copy they can change without touching the cache
+    load_config(path)["journal_name"] = "cccc"
+    assert load_config(path) == {"journal_name": "bbbb"}
+
+    # Commands, including loading the current journal again, leave the config file alone
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    SJournal(argparse.Namespace(command="load", journal_name="notes", debug=False))
+    config_path = tmp_path / "sjournal" / "sjournal_config.json"
+    mtime = os.stat(config_path).st_mtime_ns
+    SJournal(argparse.Namespace(command="load", journal_name="notes", debug=False))
+    SJournal(argparse.Namespace(command="list", debug=False))
+    assert os.stat(config_path).st_mtime_ns == mtime
+
+
+def test_note_slots_and_lazy_timestamp():
+    note = Note.from_row((7, 1647806400, "General", "hello"))
+    assert not hasattr(note, "__dict__")
+    assert note._date_time is None and note._timestamp is None
+    assert note.epoch == 1647806400
+
+    from datetime import datetime
+    assert note.timestamp == datetime.fromtimestamp(1647806400).strftime("%m-%d-%y %H:%M:%S")
+    assert note == Note(7, "General", "hello", date_time=datetime.fromtimestamp(1647806400))
+    assert Note(8, "General", "new").record["timestamp"] > 1647806400
+
+    # Timestamps can still be assigned; the other representations follow
+    note.timestamp = "03-20-22 15:30:55"
+    assert note.date_time == datetime(2022, 3, 20, 15, 30, 55)
+    assert note.record["timestamp"] == int(datetime(2022, 3, 20, 15, 30, 55).timestamp())
+    note.date_time = datetime(2023, 1, 2, 3, 4, 5)
+    assert (note.timestamp, note.epoch) == ("01-02-23 03:04:05", int(datetime(2023, 1, 2, 3, 4, 5).timestamp()))
+
+
+def test_iter_notes_and_length(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    journal = SJournal(argparse.Namespace(command="load", journal_name="library", debug=False))
+    journal.run()
+    for i in range(10):
+        journal.args = argparse.Namespace(command="add", category=["Work", "Home"][i % 2], content=[f"note {i}"],
+                                          style=None, debug=False)
+        journal.run()
+
+    # Filters match "sjournal list"; notes come back in ID order, batch by batch
+    assert [note.id for note in journal.iter_notes(batch_size=3)] == list(range(10))
+    assert [note.id for note in journal.iter_notes(category="Work", ids=["2-6"])] == [2, 4, 6]
+    assert [note.id for note in journal.iter_notes(ids=[8, 9])] == [8, 9]
+    notes = journal.iter_notes()
+    assert next(notes).content == "note 0"
+
+    # length is counted by SQLite and neither call closes the connection
+    statements = []
+    journal.connection.set_trace_callback(statements.append)
+    assert journal.length == 10
+    assert statements == ["SELECT count(*) FROM notes"]
+    assert len(journal.notes) == 10
+    assert journal.connection.execute("SELECT 1").fetchone() == (1,)
+    journal.close_connection()
+
+
+def test_library_transactions(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    with SJournal.open("library") as journal:
+        statements = []
+        journal.connection.set_trace_callback(statements.append)
+        with journal.transaction():
+            assert journal.add_many(f"note {i}" for i in range(2000)) == 2000
+            journal.add_many([{"content": "planned", "category": "Work", "timestamp": "2022-03-20 12:00"}])
+        assert statements.count("COMMIT") == 1
+        assert journal.count() == 2001
+        assert journal.get(2000).category == "Work"
+
+        # A failing nested block rolls back to its savepoint; the outer block still commits
+        with journal.transaction():
+            journal.delete_many(["0-9"])
+            with pytest.raises(ValueError):
+                with journal.transaction():
+                    journal.update_many([{"id": 10, "content": "changed"}])
+                    raise ValueError
+        assert journal.count() == 1991
+        assert journal.get(10).content == "note 10"
+
+        # Empty batches change nothing
+        assert journal.add_many([]) == 0
+        assert journal.delete_many([]) == 0
+        assert journal.update_many([]) == 0
+        assert journal.count() == 1991
+        with pytest.raises(ValueError, match="no IDs"):
+            id_filter([])
+        with pytest.raises(ValueError, match="no content"):
+            journal.add_many(["kept?", {"content": None}])
+        assert journal.count() == 1991
+
+        statements.clear()
+        assert journal.update_many([{"id": 11, "category": "Home"}, {"id": 12, "content": "other text"}]) == 2
+        # Only the content change touches the full-text index
+        assert {s for s in statements if s.startswith("UPDATE")} == {
+                "UPDATE notes SET category_id = (SELECT id FROM categories WHERE name = 'Home') WHERE id = 11",
+                "UPDATE notes SET content = 'other text' WHERE id = 12"}
+        statements.clear()
+        assert journal.update_many([{"id": 13, "category": "Home", "timestamp": "2022-03-20 12:00"}]) == 1
+        assert not [s for s in statements if "notes_fts" in s]
+        assert journal.get(11).category == "Home" and journal.get(11).content == "note 11"
+        assert journal.count(category="Home") == 2
+        assert [note.id for note in journal.find("other")] == [12]
+        assert [note.id for note in journal.find(r"note 1\d$", regex=True, limit=3)] == [19, 18, 17]
+
+        # An exception in the outermost block adds nothing
+        with pytest.raises(RuntimeError):
+            with journal.transaction():
+                journal.add_many(["lost"])
+                raise RuntimeError
+        assert journal.count() == 1991
+
+        # Commands run inside a block leave committing to it too
+        with pytest.raises(RuntimeError):
+            with journal.transaction():
+                journal.add_many(["lost"])
+                journal.args = argparse.Namespace(command="delete", delete_criteria=["11"], since=None, until=None,
+                                                  verbose=False, debug=False)
+                journal.delete()
+                journal.args = argparse.Namespace(command="update", ids=["12"], since=None, until=None,
+                                                  category="Later", style=None, debug=False)
+                journal.update()
+                raise RuntimeError
+        assert journal.count() == 1991
+        assert journal.get(11).category == "Home" and journal.get(12).category == "General"
+
+    assert os.path.isfile(tmp_path / "sjournal" / "journals" / "library.db")
+    # Opening a journal by name does not switch the current journal
+    assert load_config(str(tmp_path / "sjournal" / "sjournal_config.json"))["journal_name"] == "notes"
+
+
+def test_category_counts(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    with SJournal.open("counts") as journal:
+        journal.add_many({"content": f"note {i}", "category": ["Work", "Home", "Errands"][i % 3]} for i in range(300))
+        journal.update_many([{"id": 0, "category": "Home"}, {"id": 1, "category": "Someday"}])
+        journal.delete_many(["2-101"])
+
+        def counts():
+            return dict(journal.connection.execute("SELECT name, note_count FROM categories WHERE note_count > 0"))
+
+        actual = dict(journal.connection.execute("SELECT category, count(*) FROM note_rows GROUP BY category"))
+        assert counts() == actual == {"Work": 66, "Home": 67, "Errands": 66, "Someday": 1}
+        # Each name is stored once however many notes use it
+        assert journal.connection.execute("SELECT count(*) FROM categories").fetchone()[0] == 4
+
+        journal.args = argparse.Namespace(command="categories", search=None, quantity=None, all=True, debug=False)
+        capsys.readouterr()
+        journal.categories()
+        assert capsys.readouterr().out.split() == ["Errands", "(66)", "Home", "(67)", "Someday", "(1)", "Work", "(66)"]
+
+
+def test_regex_filters_run_in_sqlite(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    with SJournal.open("patterns") as journal:
+        journal.add_many({"content": f"{'Deploy' if i % 10 == 0 else 'note'} {i}", "category": f"Team {i % 12}"}
+                         for i in range(100))
+        statements = []
+        journal.connection.set_trace_callback(statements.append)
+        compile_pattern.cache_clear()
+        capsys.readouterr()
+
+        # -q counts matches, not rows read before filtering; the pattern is compiled once for all rows
+        journal.args = parse_args(["search", "--regex", "deploy \\d+", "-q", "3", "--format", "jsonl"])
+        journal.search()
+        assert [json.loads(line)["id"] for line in capsys.readouterr().out.splitlines()] == [90, 80, 70]
+        assert any("REGEXP" in statement and "LIMIT" in statement for statement in statements)
+        assert compile_pattern.cache_info().misses == 1
+
+        journal.args = parse_args(["categories", "-s", "^team 1", "--format", "plain"])
+        journal.categories()
+        assert capsys.readouterr().out.splitlines() == ["Team 1", "Team 10", "Team 11"]
+
+        journal.args = parse_args(["search", "--regex", "deploy ("])
+        journal.search()
+        assert "Invalid pattern" in capsys.readouterr().out
+
+
+def test_relative_date_filters(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    now = int(time.time())
+    assert now - 7 * 86400 - 1 <= parse_time_filter("7d") <= now - 7 * 86400 + 1
+    assert abs(parse_time_filter("30m") - (now - 1800)) <= 1
+    assert parse_time_filter("2022-03-20") == parse_time_filter("03-20-22 00:00:00")
+    with pytest.raises(ValueError):
+        parse_time_filter("7 fortnights")
+    # A bare four-digit number is a year; other bare numbers are not read as epoch seconds
+    assert parse_time_filter("2022") == parse_time_filter("2022-01-01")
+    for value in ["20220320", "1647790255", "-5"]:
+        with pytest.raises(ValueError, match="not a date"):
+            parse_time_filter(value)
+    assert parse_time_filter(1647790255) == 1647790255
+
+    with SJournal.open("dates") as journal:
+        # One note every 12 hours over the last ten days, oldest first
+        journal.add_many({"content": f"note {i}", "timestamp": now - (20 - i) * 43200 + 60} for i in range(20))
+        capsys.readouterr()
+
+        def shown(argv):
+            journal.args = parse_args(argv + ["--format", "jsonl"])
+            getattr(journal, argv[0])()
+            return sorted(json.loads(line)["id"] for line in capsys.readouterr().out.splitlines())
+
+        assert shown(["list", "-a", "--since", "2d"]) == [16, 17, 18, 19]
+        assert shown(["search", "note", "--since", "3d", "--until", "1d"]) == [14, 15, 16, 17]
+        assert shown(["search", "--regex", "note 1", "--since", "1w", "-q", "20"]) == list(range(10, 20))
+        assert shown(["list", "-a", "--since", str(time.localtime().tm_year + 1)]) == []
+        assert shown(["list", "-a", "--until", str(time.localtime().tm_year + 1)]) == list(range(20))
+
+        journal.args = parse_args(["delete", "--until", "1w"])
+        journal.delete()
+        assert "DELETED 6 NOTES" in capsys.readouterr().out
+        assert journal.count() == 14
+
+        journal.args = parse_args(["delete", "--since", "yesterday"])
+        journal.delete()
+        assert "Invalid filter" in capsys.readouterr().out
+        assert journal.count() == 14
+
+
+@pytest.mark.parametrize('content, style, expected', [
+        ("plain", "bold", "[bold]plain[/]"),
+        ("[red]styled[/]", "bold", "[bold]styled[/]"),
+        ("[red]styled[/]", "", "styled"),
+        ("[red]keeps [i]inner[/] markup[/]", "blue", "[blue]keeps [i]inner[/] markup[/]"),
+        ("[b]a[/] and [i]b[/]", "blue", "[blue][b]a[/] and [i]b[/][/]"),
+])
+def test_restyle(content, style, expected):
+    assert restyle(content, style) == expected
+
+
+def test_edit_and_update_in_place(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    monkeypatch.setattr("rich.prompt.Prompt.ask", lambda *args, **kwargs: "rewritten")
+    monkeypatch.setattr("pyperclip.copy", lambda text: None)
+    with SJournal.open("in_place") as journal:
+        journal.add_many({"content": f"note {i}", "category": "Inbox"} for i in range(10))
+        statements = []
+        journal.connection.set_trace_callback(statements.append)
+
+        # edit rewrites the content with one UPDATE and keeps the note's ID, time and category
+        before = journal.get(4)
+        journal.args = parse_args(["edit", "4"])
+        journal.edit()
+        assert not [s for s in statements if re.match(r"\s*(DELETE|INSERT INTO notes)", s)]
+        after = journal.get(4)
+        assert (after.content, after.category, after.epoch) == ("rewritten", "Inbox", before.epoch)
+        assert [note.id for note in journal.find("rewritten")] == [4]
+
+        # Moving notes to another category does not touch the full-text index
+        statements.clear()
+        journal.args = parse_args(["update", "--ids", "0-5", "-c", "Done"])
+        journal.update()
+        assert len({s for s in statements if s.startswith("UPDATE notes")}) == 1
+        assert not any("notes_fts" in statement for statement in statements)
+        assert journal.count(category="Done") == 6 and journal.count(category="Inbox") == 4